@@ -0,0 +1,280 @@
+import os
+import math
+import time
+import asyncio
+import ipaddress
+import threading
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+from . import auth
+
+# Limites por rota: (concorrência máxima, orçamento de fila em ms)
+LOGIN_CONCURRENCY = int(os.getenv('ADMISSION_LOGIN_CONCURRENCY', '4'))
+ANALYTICS_CONCURRENCY = int(os.getenv('ADMISSION_ANALYTICS_CONCURRENCY', '2'))
+QUEUE_BUDGET_MS = int(os.getenv('ADMISSION_QUEUE_BUDGET_MS', '250'))
+# Requisições de agregação esperando um cálculo idêntico em andamento (esperam no loop, sem thread)
+ANALYTICS_MAX_FOLLOWERS = int(os.getenv('ADMISSION_ANALYTICS_MAX_FOLLOWERS', '256'))
+
+# Token buckets do /token: taxa (tokens/s) e rajada máxima
+LOGIN_RATE_PER_CLIENT = float(os.getenv('LOGIN_RATE_PER_CLIENT', '1.0'))
+LOGIN_BURST_PER_CLIENT = int(os.getenv('LOGIN_BURST_PER_CLIENT', '10'))
+LOGIN_RATE_PER_USERNAME = float(os.getenv('LOGIN_RATE_PER_USERNAME', '0.2'))
+LOGIN_BURST_PER_USERNAME = int(os.getenv('LOGIN_BURST_PER_USERNAME', '5'))
+
+# Proxies reversos confiáveis (IPs ou redes, separados por vírgula): para conexões vindas deles, o
+# cliente dos limites por cliente é lido do X-Forwarded-For. Vazio: vale o IP da conexão.
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip(), strict=False)
+                   for proxy in os.getenv('TRUSTED_PROXIES', '').split(',') if proxy.strip()]
+
+
+class TokenBucket:
+    """Conjunto de token buckets indexados por chave (cliente, username...)"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Consome um token; retorna 0 se permitido ou os segundos até o próximo token"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+            return 0.0
+
+    def _evict(self, now: float):
+        # Buckets que já estariam cheios não carregam estado útil
+        refill = self.burst / self.rate
+        for key, (_, last) in list(self._buckets.items()):
+            if now - last >= refill:
+                del self._buckets[key]
+
+
+class RouteLimit:
+    """Limite de concorrência com fila limitada por orçamento de latência"""
+
+    def __init__(self, concurrency: int, budget_ms: int):
+        self.concurrency = concurrency
+        self.budget = budget_ms / 1000
+        self.waiting = 0
+        self.service_time = 0.0  # média móvel do tempo de atendimento
+        self._loop = None
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Criado no loop em execução: um asyncio.Semaphore fica preso ao loop em que foi usado
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def expected_wait(self) -> float:
+        return (self.waiting + 1) * self.service_time / self.concurrency
+
+    async def acquire(self):
+        """Retorna o semáforo adquirido, ou None se a espera estouraria o orçamento"""
+        semaphore = self.semaphore
+        if semaphore.locked() and self.expected_wait() > self.budget:
+            return None
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.budget)
+            return semaphore
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiting -= 1
+
+    def release(self, semaphore, elapsed: float):
+        self.service_time = elapsed if not self.service_time else 0.8 * self.service_time + 0.2 * elapsed
+        semaphore.release()
+
+
+class _Flight:
+    __slots__ = ('admitted', 'semaphore', 'requests', 'started')
+
+    def __init__(self, admitted):
+        self.admitted = admitted  # future: a primeira requisição do grupo conseguiu vaga?
+        self.semaphore = None
+        self.requests = 1
+        self.started = 0.0
+
+
+class FlightAdmission:
+    """Admissão por grupo de requisições idênticas (mesma rota, query e papel do token).
+
+    A primeira requisição de um grupo ocupa uma vaga do RouteLimit; as seguintes, que o
+    single-flight do endpoint vai coalescer, entram sem vaga (até max_followers no total). Um
+    painel com dezenas de telas atualizando juntas gera um cálculo, não dezenas de 503, e a
+    rejeição acontece antes da autenticação e do pool do banco. A vaga volta quando a última
+    requisição do grupo termina.
+    """
+
+    def __init__(self, limit: RouteLimit, max_followers: int):
+        self.limit = limit
+        self.max_followers = max_followers
+        self.followers = 0
+        self._flights = {}
+
+    async def enter(self, key):
+        """Retorna o grupo em que a requisição foi admitida, ou None se deve ser rejeitada"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.get_running_loop().create_future())
+            try:
+                flight.semaphore = await self.limit.acquire()
+            finally:
+                flight.started = time.monotonic()
+                flight.admitted.set_result(flight.semaphore is not None)
+                if flight.semaphore is None:
+                    del self._flights[key]
+            return flight if flight.semaphore is not None else None
+
+        if self.followers >= self.max_followers:
+            return None
+        flight.requests += 1
+        self.followers += 1
+        if await asyncio.shield(flight.admitted):
+            return flight
+        self.leave(key, flight)
+        return None
+
+    def leave(self, key, flight):
+        # Seguidores = requisições além da primeira em cada grupo, qualquer que seja a que sai
+        if flight.requests > 1:
+            self.followers -= 1
+        flight.requests -= 1
+        if flight.requests:
+            return
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.semaphore is not None:
+            self.limit.release(flight.semaphore, time.monotonic() - flight.started)
+
+
+# Rotas caras por prefixo, limitadas antes do endpoint; as demais passam direto
+ROUTE_LIMITS = [
+    ('/token', RouteLimit(LOGIN_CONCURRENCY, QUEUE_BUDGET_MS)),
+]
+
+# Agregações: admitidas por grupo de requisições idênticas (ver FlightAdmission)
+FLIGHT_ROUTES = ('/dashboard/stats', '/analytics/')
+analytics_admission = FlightAdmission(RouteLimit(ANALYTICS_CONCURRENCY, QUEUE_BUDGET_MS), ANALYTICS_MAX_FOLLOWERS)
+
+client_buckets = TokenBucket(LOGIN_RATE_PER_CLIENT, LOGIN_BURST_PER_CLIENT)
+username_buckets = TokenBucket(LOGIN_RATE_PER_USERNAME, LOGIN_BURST_PER_USERNAME)
+
+
+def _match(path: str):
+    for prefix, limit in ROUTE_LIMITS:
+        if path.startswith(prefix):
+            return limit
+    return None
+
+
+def _flight_key(scope):
+    """(rota, query, papel) das agregações; o papel vem do token sem validação, só para agrupar.
+
+    Quem acabou de escrever não entra no voo de outros (o resultado pode ser anterior à escrita):
+    recebe uma chave própria e ocupa uma vaga de concorrência como qualquer cálculo.
+    """
+    if auth.wrote_recently(Request(scope)):
+        return scope['path'], scope['query_string'], object()
+    role = None
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            try:
+                role = jwt.get_unverified_claims(value.decode('latin-1').partition(' ')[2]).get('role')
+            except (JWTError, AttributeError):
+                pass
+            break
+    return scope['path'], scope['query_string'], role
+
+
+def _busy(limit):
+    retry_after = max(1, math.ceil(limit.expected_wait()))
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, try again later"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI que rejeita com 503 quando a fila de uma rota cara estoura o orçamento"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(FLIGHT_ROUTES):
+            return await self._admit_flight(scope, receive, send)
+        limit = _match(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        semaphore = await limit.acquire()
+        if semaphore is None:
+            return await _busy(limit)(scope, receive, send)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release(semaphore, time.monotonic() - started)
+
+    async def _admit_flight(self, scope, receive, send):
+        key = _flight_key(scope)
+        flight = await analytics_admission.enter(key)
+        if flight is None:
+            return await _busy(analytics_admission.limit)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            analytics_admission.leave(key, flight)
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_address(request: Request) -> str:
+    """Endereço do cliente: atrás de proxies confiáveis, o último salto não confiável do X-Forwarded-For.
+
+    Os saltos à esquerda do primeiro não confiável são escritos pelo próprio cliente e não valem.
+    """
+    host = request.client.host if request.client else 'unknown'
+    if not _trusted(host):
+        return host
+    for hop in reversed(request.headers.get('x-forwarded-for', '').split(',')):
+        hop = hop.strip()
+        if hop and not _trusted(hop):
+            return hop
+    return host
+
+
+def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """Dependência do /token: aplica token buckets por cliente e por username antes do bcrypt"""
+    retry_after = client_buckets.take(client_address(request)) or username_buckets.take(form_data.username.lower())
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail='Too many login attempts',
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
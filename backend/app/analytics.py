@@ -0,0 +1,408 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from . import models, cache_bus, columnar, sharding
+
+# Horário comercial (em horas, no fuso definido por ANALYTICS_UTC_OFFSET_HOURS)
+BUSINESS_HOURS_START = int(os.getenv('BUSINESS_HOURS_START', '7'))
+BUSINESS_HOURS_END = int(os.getenv('BUSINESS_HOURS_END', '19'))
+ANALYTICS_UTC_OFFSET_HOURS = int(os.getenv('ANALYTICS_UTC_OFFSET_HOURS', '0'))
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', '60'))
+
+EPOCH = datetime(1970, 1, 1)
+FETCH_CHUNK = 200_000
+MAX_ITEMS = 100  # itens detalhados por categoria na resposta
+DENIAL_RATE_THRESHOLD = 0.3
+MIN_DENIALS = 3
+BASELINE_BUCKETS = 24
+
+# Colunas extraídas de access_logs, na ordem das tuplas retornadas
+WINDOW_COLUMNS = ('id', 'user_id', 'area_id', 'ts', 'denied', 'exit')
+
+
+# SQL puro: as tuplas vão direto do cursor para o NumPy, sem Row/ORM do SQLAlchemy
+WINDOW_SQL = """
+    SELECT id, COALESCE(user_id, 0), COALESCE(area_id, 0),
+           CAST(strftime('%s', access_time) AS INTEGER),
+           status = 'denied', access_type = 'exit'
+    FROM access_logs
+    WHERE access_time >= ? AND access_time < ?
+"""
+
+
+def _fetch_array(db: Session, sql: str, params: tuple, n_columns: int):
+    """Executa SQL no cursor DBAPI e empilha o resultado, em blocos, num array int64 (linhas x colunas)"""
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+    finally:
+        cursor.close()
+    return np.concatenate(chunks) if chunks else np.empty((0, n_columns), dtype=np.int64)
+
+
+def _load_shard_window(db: Session, start: datetime, end: datetime):
+    segments = columnar.store_for(db.get_bind())
+    if segments:
+        return columnar.load_window(db, start, end, segments)
+    data = _fetch_array(db, WINDOW_SQL, (start.isoformat(sep=' '), end.isoformat(sep=' ')), len(WINDOW_COLUMNS))
+    window = {name: data[:, i] for i, name in enumerate(WINDOW_COLUMNS)}
+    window['denied'] = window['denied'].astype(bool)
+    window['exit'] = window['exit'].astype(bool)
+    return window
+
+
+def load_access_window(db: Session, start: datetime, end: datetime):
+    """Carrega os logs da janela [start, end) de todos os shards em arrays NumPy, sem hidratar objetos ORM"""
+    windows = sharding.scatter(lambda shard_db: _load_shard_window(shard_db, start, end), db)
+    if len(windows) == 1:
+        return windows[0]
+    return {name: np.concatenate([window[name] for window in windows]) for name in WINDOW_COLUMNS}
+
+
+def _denial_rates(ids: np.ndarray, denied: np.ndarray, key: str):
+    if ids.size == 0:
+        return []
+    unique, inverse = np.unique(ids, return_inverse=True)
+    totals = np.bincount(inverse)
+    denials = np.bincount(inverse, weights=denied).astype(np.int64)
+    rates = denials / totals
+    flagged = np.flatnonzero((rates >= DENIAL_RATE_THRESHOLD) & (denials >= MIN_DENIALS))
+    flagged = flagged[np.lexsort((-denials[flagged], -rates[flagged]))][:MAX_ITEMS]
+    return [
+        {key: int(unique[i]), "total": int(totals[i]), "denied": int(denials[i]), "denial_rate": float(rates[i])}
+        for i in flagged
+    ]
+
+
+def _bursts(window, start_ts: int, bucket_seconds: int, n_buckets: int, z_threshold: float):
+    """z-score da contagem de eventos por área e intervalo contra a média móvel dos intervalos anteriores"""
+    if window['ts'].size == 0 or n_buckets <= BASELINE_BUCKETS:
+        return []
+    areas, area_idx = np.unique(window['area_id'], return_inverse=True)
+    bucket = np.clip((window['ts'] - start_ts) // bucket_seconds, 0, n_buckets - 1)
+    flat = area_idx * n_buckets + bucket
+    size = areas.size * n_buckets
+    counts = np.bincount(flat, minlength=size).reshape(areas.size, n_buckets).astype(np.float64)
+    denied = np.bincount(flat, weights=window['denied'], minlength=size).reshape(areas.size, n_buckets)
+
+    # Somas acumuladas permitem média e desvio da janela anterior em O(1) por célula
+    w = BASELINE_BUCKETS
+    zeros = np.zeros((areas.size, 1))
+    csum = np.hstack([zeros, np.cumsum(counts, axis=1)])
+    csq = np.hstack([zeros, np.cumsum(counts ** 2, axis=1)])
+    mean = (csum[:, w:-1] - csum[:, :-w - 1]) / w
+    var = (csq[:, w:-1] - csq[:, :-w - 1]) / w - mean ** 2
+    std = np.maximum(np.sqrt(np.maximum(var, 0)), np.maximum(np.sqrt(mean), 1.0))
+    current = counts[:, w:]
+    z = (current - mean) / std
+
+    rows, cols = np.nonzero(z >= z_threshold)
+    order = np.argsort(-z[rows, cols])[:MAX_ITEMS]
+    return [
+        {
+            "area_id": int(areas[r]),
+            "bucket_start": datetime.utcfromtimestamp(start_ts + int(c + w) * bucket_seconds),
+            "events": int(current[r, c]),
+            "denied": int(denied[r, c + w]),
+            "baseline_mean": float(mean[r, c]),
+            "z_score": float(z[r, c]),
+        }
+        for r, c in zip(rows[order], cols[order])
+    ]
+
+
+def _events(window, mask: np.ndarray):
+    idx = np.flatnonzero(mask)
+    idx = idx[np.argsort(window['ts'][idx], kind='stable')][:MAX_ITEMS]
+    return [
+        {
+            "log_id": int(window['id'][i]),
+            "user_id": int(window['user_id'][i]),
+            "area_id": int(window['area_id'][i]),
+            "access_time": datetime.utcfromtimestamp(int(window['ts'][i])),
+        }
+        for i in idx
+    ]
+
+
+def _after_hours_critical(window, critical_areas: np.ndarray):
+    hours = ((window['ts'] // 3600) + ANALYTICS_UTC_OFFSET_HOURS) % 24
+    if BUSINESS_HOURS_START <= BUSINESS_HOURS_END:
+        business = (hours >= BUSINESS_HOURS_START) & (hours < BUSINESS_HOURS_END)
+    else:
+        business = (hours >= BUSINESS_HOURS_START) | (hours < BUSINESS_HOURS_END)
+    mask = np.isin(window['area_id'], critical_areas) & ~business & ~window['denied']
+    return int(mask.sum()), _events(window, mask)
+
+
+def _impossible_sequences(window):
+    """Entradas (ou saídas) consecutivas do mesmo usuário na mesma área, considerando só acessos concedidos"""
+    granted = np.flatnonzero(~window['denied'])
+    if granted.size < 2:
+        return 0, []
+    user, area, ts, exit_ = (window[k][granted] for k in ('user_id', 'area_id', 'ts', 'exit'))
+    order = np.lexsort((window['id'][granted], ts, area, user))
+    user, area, exit_ = user[order], area[order], exit_[order]
+    same = (user[1:] == user[:-1]) & (area[1:] == area[:-1])
+    repeated = same & (exit_[1:] == exit_[:-1])
+    mask = np.zeros(window['id'].size, dtype=bool)
+    mask[granted[order][1:][repeated]] = True
+    items = _events(window, mask)
+    exits = set(window['id'][mask & window['exit']].tolist())
+    for item in items:
+        item["kind"] = "exit_without_entry" if item["log_id"] in exits else "entry_without_exit"
+    return int(mask.sum()), items
+
+
+def detect_anomalies(db: Session, start: datetime, end: datetime, bucket_minutes: int = 60, z_threshold: float = 3.0):
+    window = load_access_window(db, start, end)
+    critical = np.array(
+        db.execute(select(models.RestrictedArea.id).where(models.RestrictedArea.security_level == 'critical')).scalars().all(),
+        dtype=np.int64,
+    )
+    bucket_seconds = bucket_minutes * 60
+    start_ts = int((start - EPOCH).total_seconds())
+    n_buckets = max(1, -(-int((end - start).total_seconds()) // bucket_seconds))
+
+    after_hours_total, after_hours = _after_hours_critical(window, critical)
+    sequences_total, sequences = _impossible_sequences(window)
+    return {
+        "window_start": start,
+        "window_end": end,
+        "total_events": int(window['id'].size),
+        "denied_events": int(window['denied'].sum()),
+        "denial_rates_by_user": _denial_rates(window['user_id'], window['denied'], 'user_id'),
+        "denial_rates_by_area": _denial_rates(window['area_id'], window['denied'], 'area_id'),
+        "bursts": _bursts(window, start_ts, bucket_seconds, n_buckets, z_threshold),
+        "after_hours_critical_total": after_hours_total,
+        "after_hours_critical": after_hours,
+        "impossible_sequences_total": sequences_total,
+        "impossible_sequences": sequences,
+    }
+
+
+# Cache por janela, invalidado entre workers quando logs ou áreas mudam
+_cache = cache_bus.VersionedCache(('access_logs', 'restricted_areas'), ANALYTICS_CACHE_TTL)
+
+
+def cached(key, compute):
+    return _cache.get_or_compute(key, compute)
+
+
+def resolve_window(start: Optional[datetime], end: Optional[datetime], bucket_minutes: int, default_days: int = 7):
+    """Janela padrão: últimos `default_days` dias, com fim alinhado ao intervalo para reaproveitar o cache"""
+    # access_time é gravado em UTC sem fuso (datetime.utcnow)
+    if start is not None and start.tzinfo:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end is not None and end.tzinfo:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if end is None:
+        bucket_seconds = bucket_minutes * 60
+        now = int(time.time())
+        end = datetime.utcfromtimestamp(now - now % bucket_seconds + bucket_seconds)
+    if start is None:
+        start = end - timedelta(days=default_days)
+    return start, end
+
+
+# Heatmap área x intervalo: tamanho do intervalo em segundos e deslocamento para alinhar
+# semanas na segunda-feira (1970-01-01 foi uma quinta-feira)
+HEATMAP_BUCKETS = {'hour': (3600, 0), 'day': (86400, 0), 'week': (604800, 3 * 86400)}
+
+# Células (áreas x intervalos) por heatmap; acima disso a requisição é recusada (400)
+HEATMAP_MAX_CELLS = int(os.getenv('HEATMAP_MAX_CELLS', '2000000'))
+
+# Um vetor empacotado por intervalo (ver models.AccessLogRollupVector): 5 mil áreas x 365 dias viram
+# 365 linhas lidas direto para o NumPy, sem agrupar 1,8 milhão de linhas dos agregados
+HEATMAP_VECTOR_SQL = """
+    SELECT bucket_start, version, area_ids, granted, denied
+    FROM access_log_rollup_vectors
+    WHERE granularity = ? AND bucket_start >= ? AND bucket_start < ?
+"""
+ROLLUP_BUCKET_SQL = """
+    SELECT area_id, granted, denied FROM access_log_rollups
+    WHERE granularity = ? AND bucket_start = ? ORDER BY area_id
+"""
+STORE_VECTOR_SQL = text("""
+    UPDATE access_log_rollup_vectors SET area_ids = :area_ids, granted = :granted, denied = :denied
+    WHERE granularity = :granularity AND bucket_start = :bucket_start AND version = :version
+""")
+STALE_VECTORS_SQL = "SELECT bucket_start, version FROM access_log_rollup_vectors WHERE granularity = ? AND area_ids IS NULL"
+VECTOR_DTYPE = np.dtype('<i4')
+PACK_CHUNK = 500  # vetores gravados por transação no empacotamento completo
+
+HEATMAP_RAW_SQL = """
+    SELECT area_id, (CAST(strftime('%s', access_time) AS INTEGER) + ?) / ?,
+           SUM(status != 'denied'), SUM(status = 'denied')
+    FROM access_logs
+    WHERE access_time >= ? AND access_time < ? AND area_id IS NOT NULL
+    GROUP BY 1, 2
+"""
+
+
+def align_range(start: datetime, end: datetime, bucket: str):
+    """Alinha start para baixo e end para cima nos limites do intervalo"""
+    size, offset = HEATMAP_BUCKETS[bucket]
+    first = (int((start - EPOCH).total_seconds()) + offset) // size
+    last = -(-(int((end - EPOCH).total_seconds()) + offset) // size)
+    to_datetime = lambda index: EPOCH + timedelta(seconds=index * size - offset)
+    return first, max(last, first + 1), to_datetime
+
+
+def rollups_available(db: Session):
+    """Agregados cobrem todo o histórico do banco: criado vazio ou com backfill concluído (python -m app.rollups)"""
+    return db.execute(select(models.AccessLogRollupState.id)).first() is not None
+
+
+class HeatmapTooLarge(ValueError):
+    pass
+
+
+def _store_vectors(shard, granularity: str, packed: list):
+    """Grava os vetores remontados; os de intervalos escritos nesse meio tempo (versão mudou) ficam de fora"""
+    db = shard.SessionLocal()
+    try:
+        db.execute(STORE_VECTOR_SQL, [
+            {"area_ids": area_ids, "granted": granted, "denied": denied,
+             "granularity": granularity, "bucket_start": bucket_start, "version": version}
+            for bucket_start, version, area_ids, granted, denied in packed
+        ])
+        db.commit()
+    except OperationalError:
+        # Banco ocupado ou somente leitura: a próxima leitura remonta de novo
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _pack(cursor, granularity: str, bucket_start: str, version: int):
+    cursor.execute(ROLLUP_BUCKET_SQL, (granularity, bucket_start))
+    rows = np.array(cursor.fetchall(), dtype=VECTOR_DTYPE).reshape(-1, 3)
+    return (bucket_start, version) + tuple(rows[:, j].tobytes() for j in range(3))
+
+
+def pack_rollup_vectors(shard, db: Session):
+    """Empacota todos os vetores desatualizados do shard (fim do backfill, python -m app.rollups)"""
+    cursor = db.connection().connection.cursor()
+    try:
+        for granularity in ('hour', 'day'):
+            cursor.execute(STALE_VECTORS_SQL, (granularity,))
+            stale = cursor.fetchall()
+            for chunk in range(0, len(stale), PACK_CHUNK):
+                packed = [_pack(cursor, granularity, bucket_start, version) for bucket_start, version in stale[chunk:chunk + PACK_CHUNK]]
+                _store_vectors(shard, granularity, packed)
+    finally:
+        cursor.close()
+
+
+def _fetch_vectors(shard, db: Session, granularity: str, bounds: tuple):
+    """Vetores (bucket_start, versão, áreas, concedidos, negados) dos agregados no período, em bytes int32.
+
+    Vetores desatualizados por escritas recentes (em geral só o intervalo corrente) são remontados
+    a partir de access_log_rollups e gravados para as próximas leituras.
+    """
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(HEATMAP_VECTOR_SQL, (granularity,) + bounds)
+        vectors = cursor.fetchall()
+        packed = []
+        for i, (bucket_start, version, area_ids, _, _) in enumerate(vectors):
+            if area_ids is None:
+                vectors[i] = _pack(cursor, granularity, bucket_start, version)
+                packed.append(vectors[i])
+    finally:
+        cursor.close()
+    if packed:
+        _store_vectors(shard, granularity, packed)
+    return vectors
+
+
+def _positions(area_ids: np.ndarray, ids: np.ndarray):
+    """Colunas de ids na matriz e máscara dos que ainda existem (áreas excluídas são descartadas)"""
+    if ids.size == area_ids.size and np.array_equal(ids, area_ids):
+        return slice(None), slice(None)
+    position = np.searchsorted(area_ids, ids)
+    known = position < area_ids.size
+    known[known] = area_ids[position[known]] == ids[known]
+    if known.all():
+        return position, slice(None)
+    return position[known], known
+
+
+def _vector_counts(vectors, area_ids: np.ndarray, first: int, n_buckets: int, offset: int, size: int):
+    """Soma os vetores numa matriz intervalo x área; os dias de uma semana caem na mesma linha"""
+    granted = np.zeros((n_buckets, area_ids.size), dtype=np.int64)
+    denied = np.zeros((n_buckets, area_ids.size), dtype=np.int64)
+    positions = {}  # o conjunto de áreas costuma se repetir em todos os intervalos
+    for bucket_start, _, ids, bucket_granted, bucket_denied in vectors:
+        row = (int((datetime.fromisoformat(bucket_start) - EPOCH).total_seconds()) + offset) // size - first
+        if ids not in positions:
+            positions[ids] = _positions(area_ids, np.frombuffer(ids, dtype=VECTOR_DTYPE))
+        columns, known = positions[ids]
+        granted[row, columns] += np.frombuffer(bucket_granted, dtype=VECTOR_DTYPE)[known]
+        denied[row, columns] += np.frombuffer(bucket_denied, dtype=VECTOR_DTYPE)[known]
+    return granted, denied
+
+
+def _row_counts(rows: np.ndarray, area_ids: np.ndarray, first: int, n_buckets: int):
+    """Linhas (área, intervalo, concedidos, negados) dos logs brutos na mesma matriz intervalo x área"""
+    columns, known = _positions(area_ids, rows[:, 0])
+    flat = (rows[known, 1] - first) * area_ids.size + columns
+    cells = n_buckets * area_ids.size
+    granted = np.bincount(flat, weights=rows[known, 2], minlength=cells).astype(np.int64)
+    denied = np.bincount(flat, weights=rows[known, 3], minlength=cells).astype(np.int64)
+    return granted.reshape(n_buckets, area_ids.size), denied.reshape(n_buckets, area_ids.size)
+
+
+def access_heatmap(db: Session, start: datetime, end: datetime, bucket: str = 'hour'):
+    """Matriz área x intervalo de acessos concedidos e negados no período"""
+    size, offset = HEATMAP_BUCKETS[bucket]
+    first, last, to_datetime = align_range(start, end, bucket)
+    range_start, range_end = to_datetime(first), to_datetime(last)
+    bounds = (range_start.isoformat(sep=' '), range_end.isoformat(sep=' '))
+
+    areas = db.execute(select(models.RestrictedArea.id, models.RestrictedArea.name).order_by(models.RestrictedArea.id)).all()
+    area_ids = np.array([area_id for area_id, _ in areas], dtype=np.int64)
+    n_buckets = last - first
+    if area_ids.size * n_buckets > HEATMAP_MAX_CELLS:
+        raise HeatmapTooLarge(
+            f'{area_ids.size} areas x {n_buckets} buckets exceeds {HEATMAP_MAX_CELLS} cells; use a shorter range or a larger bucket'
+        )
+
+    def shard_counts(shard, shard_db):
+        if rollups_available(shard_db):
+            granularity = 'hour' if bucket == 'hour' else 'day'
+            vectors = _fetch_vectors(shard, shard_db, granularity, bounds)
+            return 'rollup', _vector_counts(vectors, area_ids, first, n_buckets, offset, size)
+        rows = _fetch_array(shard_db, HEATMAP_RAW_SQL, (offset, size) + bounds, 4)
+        return 'raw', _row_counts(rows, area_ids, first, n_buckets)
+
+    # Cada shard soma seus próprios logs numa matriz; as matrizes dos shards se somam
+    results = sharding.each(shard_counts, db)
+    sources = {source for source, _ in results}
+    source = sources.pop() if len(sources) == 1 else 'mixed'
+    granted = sum(counts[0] for _, counts in results)
+    denied = sum(counts[1] for _, counts in results)
+
+    return {
+        "bucket": bucket,
+        "start": range_start,
+        "end": range_end,
+        "source": source,
+        "area_ids": area_ids.tolist(),
+        "area_names": [name for _, name in areas],
+        "buckets": [to_datetime(first + i) for i in range(n_buckets)],
+        "granted": np.ascontiguousarray(granted.T).tolist(),
+        "denied": np.ascontiguousarray(denied.T).tolist(),
+    }
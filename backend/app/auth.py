@@ -1,12 +1,15 @@
 import os
+import hmac
+import time
+import hashlib
+import threading
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from . import crud, schemas, models
-from .database import SessionLocal
+from . import crud, schemas, models, hashing
+from .database import SessionLocal, ReadSessionLocal
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,26 +18,87 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'CHANGEME')
 ALGORITHM = os.getenv('ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+# Janela em que um cliente que acabou de escrever lê do banco principal (read-your-writes)
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
-def get_db():
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Marcador read-your-writes devolvido nas escritas (cookie e cabeçalho, "<até>.<hmac>"): vale em
+# qualquer worker, ao contrário de _recent_writers, que só enxerga as escritas deste processo.
+# Clientes sem cookies reenviam o cabeçalho recebido.
+READ_YOUR_WRITES_COOKIE = 'rw_until'
+READ_YOUR_WRITES_HEADER = 'X-Read-Your-Writes'
+
+# Clientes com escrita recente neste worker: chave do cliente -> instante até o qual leem do principal
+_recent_writers = {}
+_recent_writers_lock = threading.Lock()
+
+def _client_key(request: Request):
+    return request.headers.get("authorization") or (request.client.host if request.client else "")
+
+def _mark_write(request: Request):
+    now = time.monotonic()
+    with _recent_writers_lock:
+        if len(_recent_writers) > 10_000:
+            for key in [k for k, until in _recent_writers.items() if until <= now]:
+                del _recent_writers[key]
+        _recent_writers[_client_key(request)] = now + READ_YOUR_WRITES_SECONDS
+
+def _write_signature(client_key: str, until: str):
+    return hmac.new(SECRET_KEY.encode(), f'{until}:{client_key}'.encode(), hashlib.sha256).hexdigest()
+
+def _write_marker(request: Request):
+    """Marcador assinado e ligado ao cliente; usa relógio de parede para valer entre processos"""
+    until = str(int(time.time() + READ_YOUR_WRITES_SECONDS + 1))
+    return f'{until}.{_write_signature(_client_key(request), until)}'
+
+def _valid_marker(request: Request, marker: str):
+    until, _, signature = marker.partition('.')
+    if not until.isdigit() or int(until) <= time.time():
+        return False
+    return hmac.compare_digest(signature, _write_signature(_client_key(request), until))
+
+def wrote_recently(request: Request):
+    """O cliente escreveu há menos de READ_YOUR_WRITES_SECONDS, neste ou em outro worker"""
+    if _recent_writers.get(_client_key(request), 0) > time.monotonic():
+        return True
+    marker = request.headers.get(READ_YOUR_WRITES_HEADER) or request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    return bool(marker) and _valid_marker(request, marker)
+
+def get_db(request: Request, response: Response):
+    if request.method not in SAFE_METHODS:
+        _mark_write(request)
+        marker = _write_marker(request)
+        response.headers[READ_YOUR_WRITES_HEADER] = marker
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, marker, max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+                            httponly=True, samesite='lax')
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def get_read_db(request: Request):
+    """Sessão somente leitura (pool separado); após uma escrita do próprio cliente, usa o principal"""
+    db = SessionLocal() if wrote_recently(request) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 def authenticate_user(db: Session, username: str, password: str):
     user = crud.get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = hashing.verify_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # Hash com custo diferente de BCRYPT_ROUNDS: regrava com o custo atual
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -47,33 +111,38 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def get_user_from_token(db: Session, token: str):
+    """Valida o JWT e retorna o usuário correspondente, ou None"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         role: str = payload.get("role")
         if username is None:
-            raise credentials_exception
+            return None
         token_data = schemas.TokenData(username=username, role=role)
     except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
+        return None
+    return crud.get_user_by_username(db, username=token_data.username)
+
+# Dependências síncronas: a consulta do usuário roda no threadpool, nunca no loop de eventos
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = get_user_from_token(db, token)
     if user is None:
         raise credentials_exception
     return user
 
-async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 def require_role(role: str):
-    async def role_checker(current_user: models.User = Depends(get_current_active_user)):
+    def role_checker(current_user: models.User = Depends(get_current_active_user)):
         if current_user.role != role and current_user.role != "security_admin":
             raise HTTPException(status_code=403, detail="Operation not permitted")
         return current_user
@@ -0,0 +1,441 @@
+"""Micro-benchmarks das funções do crud com verificação de plano de consulta.
+
+Cria um banco SQLite descartável com volume de produção, executa cada caso algumas vezes e:
+  - compara a mediana com a baseline gravada (falha se ficar TOLERANCE vezes mais lenta);
+  - roda EXPLAIN QUERY PLAN em cada comando emitido e falha se alguma tabela grande
+    (access_logs, rollups, associação usuário/área) for varrida sem índice;
+  - sobe a API num uvicorn real sobre o mesmo banco e dispara requisições idênticas simultâneas
+    (mais que o pool de leitura): falha se alguma der erro/timeout ou se o /health travar.
+
+Uso (a partir de backend/):
+    python -m app.benchmarks                    # compara com benchmark_baseline.json
+    python -m app.benchmarks --update-baseline  # regrava a baseline
+    python -m app.benchmarks --only access_logs --logs 50000
+"""
+import os
+import re
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import shutil
+import socket
+import threading
+import subprocess
+import contextlib
+import time
+import httpx
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from . import models, schemas, crud, analytics, hashing, cache_bus
+from .database import Base, READ_POOL_SIZE
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark_baseline.json')
+TOLERANCE = 2.0
+MIN_REGRESSION_MS = 1.0  # diferenças abaixo disso são ruído de medição
+REPEAT = 15
+
+# Tabelas que crescem sem limite: varrê-las reprova o caso. "SCAN TABLE x" é o formato do SQLite < 3.36.
+# Percorrer um índice inteiro (USING [COVERING] INDEX, ex.: count(*)) também é varredura completa;
+# só passa quando o comando tem LIMIT, que interrompe a leitura do índice ordenado.
+GUARDED_TABLES = ('access_logs', 'access_log_rollups', 'access_log_rollup_vectors', 'user_accessible_areas')
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?:%s)\b(?P<index> USING (?:COVERING )?INDEX\b)?' % '|'.join(GUARDED_TABLES))
+LIMITED = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+# Verificações HTTP: usuário criado na cópia do banco servida pelo uvicorn
+HTTP_ADMIN = 'bench-admin'
+HTTP_PASSWORD = 'bench-password'
+# Segundo security_admin: lê como outro cliente, sem o read-your-writes de quem escreveu
+HTTP_READER = 'bench-reader'
+HTTP_TIMEOUT = 60
+# Sem travamento, o /health só disputa o GIL com a rajada; travado, esperava o timeout do pool (30s)
+HEALTH_BUDGET_MS = 1000
+HTTP_BURSTS = ('/dashboard/stats', '/analytics/anomalies?bucket_minutes=5')
+# Tópicos que PUT /users/{id} invalida; o PATCH precisa invalidar os mesmos
+USER_TOPICS = ('users', 'restricted_areas')
+
+
+def seed(db, users: int, areas: int, resources: int, logs: int, now: datetime):
+    """Popula o banco com inserções em lote (executemany) e reconstrói os agregados"""
+    rng = random.Random(42)
+    db.execute(models.User.__table__.insert(), [
+        dict(username=f'user{i}', email=f'user{i}@wayne.com', hashed_password='x', full_name=f'Funcionário {i}',
+             role='employee', is_active=True, version=1)
+        for i in range(1, users + 1)
+    ])
+    db.execute(models.RestrictedArea.__table__.insert(), [
+        dict(name=f'Área {i}', security_level='critical' if i % 10 == 1 else 'medium', location=f'Site {i % 3}')
+        for i in range(1, areas + 1)
+    ])
+    db.execute(models.Resource.__table__.insert(), [
+        dict(name=f'Câmera {i}' if i % 5 == 0 else f'Equipamento {i}', type=('equipment', 'vehicle', 'security_device')[i % 3],
+             details=f'Lote {i % 97}', status=('available', 'in_use', 'maintenance')[i % 3], location=f'Sala {i % 200}',
+             version=1)
+        for i in range(1, resources + 1)
+    ])
+    # Área 1 é o campus inteiro; cada usuário tem mais duas áreas
+    memberships = {(user_id, 1) for user_id in range(1, users + 1)}
+    memberships |= {(user_id, rng.randint(2, areas)) for user_id in range(1, users + 1) for _ in range(2)}
+    db.execute(models.user_accessible_areas.insert(), [dict(user_id=u, area_id=a) for u, a in memberships])
+    for offset in range(0, logs, 50_000):
+        db.execute(models.AccessLog.__table__.insert(), [
+            dict(user_id=rng.randint(1, users), area_id=rng.randint(1, areas),
+                 access_time=now - timedelta(seconds=rng.randint(0, 30 * 86400)),
+                 access_type=rng.choice(('entry', 'exit')), status='denied' if rng.random() < 0.05 else 'granted')
+            for _ in range(offset, min(logs, offset + 50_000))
+        ])
+    db.commit()
+    crud.rebuild_access_rollups(db)
+
+
+def build_cases(users: int, areas: int, now: datetime):
+    """(nome, função(db)) para cada caminho quente; casos de escrita desfazem o próprio efeito"""
+    rng = random.Random(7)
+    ingest_seq = iter(range(1, 10 ** 9, 500))
+
+    def grant_revoke(db):
+        user_id, area_id = rng.randint(1, users), rng.randint(2, areas)
+        crud.grant_area_access(db, user_id, area_id)
+        crud.revoke_area_access(db, user_id, area_id)
+
+    def create_delete_log(db):
+        log = crud.create_access_log(db, schemas.AccessLogCreate(user_id=rng.randint(1, users), area_id=2, status='denied'))
+        crud.delete_access_log(db, log.id)
+
+    def ingest_batch(db):
+        first = next(ingest_seq)
+        events = [schemas.AccessLogEvent(seq=first + i, user_id=rng.randint(1, users), area_id=rng.randint(1, areas))
+                  for i in range(500)]
+        crud.ingest_access_logs(db, 'benchmark', events, first + 499)
+
+    def patch_resource(db):
+        crud.patch_resource(db, rng.randint(1, 1000), schemas.ResourcePatch(status='in_use'))
+
+    return [
+        ('users.list_users', lambda db: crud.list_users(db, skip=0, limit=100)),
+        ('users.get_user_by_username', lambda db: crud.get_user_by_username(db, f'user{rng.randint(1, users)}')),
+        ('resources.list_resources', lambda db: crud.list_resources(db, limit=100, status='available')),
+        ('resources.search_resources', lambda db: crud.search_resources(db, 'camera', limit=50)),
+        ('resources.get_resource', lambda db: crud.get_resource(db, rng.randint(1, 1000))),
+        ('resources.patch_resource', patch_resource),
+        ('areas.get_restricted_areas', lambda db: crud.get_restricted_areas(db, limit=100)),
+        ('areas.get_area_members', lambda db: crud.get_area_members(db, 1, skip=100, limit=100)),
+        ('areas.get_area_members_search', lambda db: crud.get_area_members(db, 1, limit=100, search='user12')),
+        ('areas.grant_revoke_area_access', grant_revoke),
+        ('access_logs.get_access_logs', lambda db: crud.get_access_logs(db, limit=100)),
+        ('access_logs.get_access_logs_deep_page', lambda db: crud.get_access_logs(db, skip=5000, limit=100)),
+        ('access_logs.get_user_access_logs', lambda db: crud.get_user_access_logs(db, rng.randint(1, users), limit=100)),
+        ('access_logs.create_delete_access_log', create_delete_log),
+        ('access_logs.ingest_access_logs', ingest_batch),
+        ('dashboard.get_dashboard_stats', crud.get_dashboard_stats),
+        ('analytics.load_access_window', lambda db: analytics.load_access_window(db, now - timedelta(days=1), now)),
+        ('analytics.access_heatmap', lambda db: analytics.access_heatmap(db, now - timedelta(days=7), now, 'hour')),
+    ]
+
+
+def full_scans(statement: str, plan):
+    """Passos do plano que varrem uma tabela vigiada (ou um índice dela sem LIMIT no comando)"""
+    limited = bool(LIMITED.search(statement))
+    scans = []
+    for step in plan:
+        match = FULL_SCAN.match(step)
+        if match and not (match.group('index') and limited):
+            scans.append(step)
+    return scans
+
+
+# Consultas de referência do detector: (comando, deve reprovar). count(*) sem filtro percorre um
+# índice inteiro; com LIMIT ou filtro indexado (SEARCH) a leitura é limitada.
+DETECTOR_CASES = (
+    ('SELECT count(*) FROM access_logs', True),
+    ("SELECT * FROM access_logs WHERE access_type = 'exit'", True),
+    ('SELECT id FROM access_logs ORDER BY id DESC LIMIT 100', False),
+    ("SELECT count(*) FROM access_logs WHERE status = 'denied'", False),
+)
+
+
+def check_detector(conn: sqlite3.Connection):
+    """Confere o detector de varreduras contra planos reais e o formato antigo (SCAN TABLE)"""
+    problems = []
+    for statement, expected in DETECTOR_CASES:
+        plan = _plan(conn, statement)
+        if bool(full_scans(statement, plan)) != expected:
+            problems.append(f'detector {"aceitou" if expected else "reprovou"} {plan} em: {statement}')
+    if not full_scans('SELECT count(*) FROM access_logs', ['SCAN TABLE access_logs USING COVERING INDEX ix_access_logs_id']):
+        problems.append('detector não reconhece o formato "SCAN TABLE" do SQLite < 3.36')
+    print(f'{"FALHOU" if problems else "ok":6} {"detector de varreduras":42} ({len(DETECTOR_CASES) + 1} planos)')
+    for problem in problems:
+        print(f'         {problem}')
+    return problems
+
+
+def _plan(conn: sqlite3.Connection, statement: str):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+
+
+@contextlib.contextmanager
+def serve(path: str):
+    """Sobe a API num uvicorn real (subprocesso) sobre uma cópia do banco semeado.
+
+    Entrega (cliente httpx, headers de um security_admin, diretório do servidor); o diretório
+    temporário recebe também o barramento de cache e o checkpoint de ocupação.
+    """
+    workdir = tempfile.mkdtemp(prefix='wayne-http-')
+    source, target = sqlite3.connect(path), sqlite3.connect(os.path.join(workdir, 'wayne_security.db'))
+    source.backup(target)
+    source.close()
+    target.executemany(
+        'INSERT INTO users (username, email, hashed_password, full_name, role, is_active, version) VALUES (?, ?, ?, ?, ?, 1, 1)',
+        [(username, f'{username}@wayne.com', hashing.hash_password(HTTP_PASSWORD), 'Benchmark', 'security_admin')
+         for username in (HTTP_ADMIN, HTTP_READER)],
+    )
+    target.commit()
+    target.close()
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=backend)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=workdir, env=env,
+    )
+    client = httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=HTTP_TIMEOUT, limits=httpx.Limits(max_connections=None))
+    try:
+        deadline = time.monotonic() + HTTP_TIMEOUT
+        while True:
+            try:
+                if client.get('/health').status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('servidor de teste não subiu')
+            time.sleep(0.1)
+        response = client.post('/token', data={'username': HTTP_ADMIN, 'password': HTTP_PASSWORD})
+        response.raise_for_status()
+        yield client, {"Authorization": f'Bearer {response.json()["access_token"]}'}, workdir
+    finally:
+        client.close()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_http_load(client, headers, requests: int, url: str):
+    """Rajada de GETs idênticos a uma agregação (mais que o pool de leitura) com /health medido no meio.
+
+    Reproduz o painel com várias telas atualizando juntas contra um uvicorn real: as requisições
+    precisam ser atendidas (200) ou recusadas cedo (503 com Retry-After), sem timeout, e o /health
+    não pode esperar por elas. Retorna a lista de problemas.
+    """
+    start = threading.Barrier(requests + 1)
+    outcomes = []
+
+    def request():
+        start.wait()
+        try:
+            response = client.get(url, headers=headers)
+            outcomes.append(response.status_code if response.status_code != 503 or 'retry-after' in response.headers
+                            else '503 sem Retry-After')
+        except httpx.HTTPError as exc:
+            outcomes.append(repr(exc))
+
+    threads = [threading.Thread(target=request) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    health = []
+    while not health or any(thread.is_alive() for thread in threads):
+        t0 = time.perf_counter()
+        try:
+            client.get('/health', timeout=1).raise_for_status()
+            health.append((time.perf_counter() - t0) * 1000)
+        except httpx.HTTPError:
+            health.append(float('inf'))
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    problems = []
+    served = outcomes.count(200)
+    failed = [outcome for outcome in outcomes if outcome not in (200, 503)]
+    if failed:
+        problems.append(f'{len(failed)} de {requests} requisições falharam ({failed[0]})')
+    if not served:
+        problems.append(f'nenhuma das {requests} requisições foi atendida')
+    if max(health) > HEALTH_BUDGET_MS:
+        problems.append(f'/health levou {max(health):.0f}ms durante a rajada (limite {HEALTH_BUDGET_MS}ms)')
+    route = url.partition('?')[0]
+    metrics = client.get('/metrics/singleflight', headers=headers).json().get(route, {})
+    status = 'FALHOU' if problems else 'ok'
+    print(f'{status:6} {"http " + route:42} {requests} simultâneas: {served} atendidas, '
+          f'{outcomes.count(503)} recusadas, {metrics.get("executions", 0)} cálculo(s); /health máx {max(health):.0f}ms')
+    return problems
+
+
+def check_user_patch(client, headers, workdir: str):
+    """PATCH de usuário invalida os mesmos tópicos do PUT e aparece na leitura de outro cliente.
+
+    O nome do usuário do log mais recente muda por PATCH; o bench-reader, que não escreveu e por
+    isso passa pelo voo compartilhado, precisa ver o nome novo em /access-logs/.
+    """
+    problems = []
+    response = client.post('/token', data={'username': HTTP_READER, 'password': HTTP_PASSWORD})
+    response.raise_for_status()
+    reader = {"Authorization": f'Bearer {response.json()["access_token"]}'}
+    log = client.get('/access-logs/?limit=1', headers=reader).json()[0]
+    bus = cache_bus.SQLiteVersionBus(os.path.join(workdir, 'cache_bus.db')) if cache_bus.CACHE_BUS == 'sqlite' else None
+    before = bus.versions(USER_TOPICS) if bus else None
+
+    full_name = f'Benchmark {time.time_ns()}'
+    response = client.patch(f'/users/{log["user"]["id"]}', json={"full_name": full_name}, headers=headers)
+    if response.status_code != 200:
+        problems.append(f'PATCH /users/{log["user"]["id"]} respondeu {response.status_code}')
+    elif bus:
+        stale = [topic for topic, old, new in zip(USER_TOPICS, before, bus.versions(USER_TOPICS)) if new <= old]
+        if stale:
+            problems.append(f'PATCH /users não invalidou {", ".join(stale)} (o PUT invalida {", ".join(USER_TOPICS)})')
+    seen = next((item["user"]["full_name"] for item in client.get('/access-logs/?limit=10', headers=reader).json()
+                 if item["id"] == log["id"]), None)
+    if seen != full_name:
+        problems.append(f'outro cliente leu full_name={seen!r} depois do PATCH (esperado {full_name!r})')
+    status = 'FALHOU' if problems else 'ok'
+    print(f'{status:6} {"http PATCH /users/{id}":42} tópicos {"+".join(USER_TOPICS)}; leitura de outro cliente')
+    for problem in problems:
+        print(f'         {problem}')
+    return problems
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='wayne-bench-')
+    path = os.path.join(workdir, 'bench.db')
+    engine = create_engine(f'sqlite:///{path}')
+    traced = []
+
+    @event.listens_for(engine, 'connect')
+    def _trace(dbapi_connection, connection_record):
+        # O callback recebe o SQL já com os parâmetros expandidos, inclusive do cursor DBAPI usado no analytics
+        dbapi_connection.set_trace_callback(traced.append)
+
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    now = datetime.utcnow().replace(microsecond=0)
+
+    started = time.perf_counter()
+    db = Session()
+    seed(db, args.users, args.areas, args.resources, args.logs, now)
+    db.close()
+    print(f'Banco semeado em {time.perf_counter() - started:.1f}s: {args.logs} logs, {args.users} usuários, '
+          f'{args.areas} áreas, {args.resources} recursos ({path})')
+
+    config = {"users": args.users, "areas": args.areas, "resources": args.resources, "logs": args.logs}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get("config") == config:
+            baseline = stored.get("cases", {})
+        elif not args.update_baseline:
+            print(f'Aviso: baseline gravada com outro volume {stored.get("config")}; só os planos serão verificados')
+
+    explain = sqlite3.connect(path)
+    results, failures = {}, []
+    failures.extend(('detector', problem) for problem in check_detector(explain))
+    for name, fn in build_cases(args.users, args.areas, now):
+        if args.only and args.only not in name:
+            continue
+        timings = []
+        for i in range(args.repeat + 1):
+            db = Session()
+            traced.clear()
+            t0 = time.perf_counter()
+            fn(db)
+            elapsed = (time.perf_counter() - t0) * 1000
+            db.close()
+            if i:  # a primeira execução só aquece cache de páginas e de statements
+                timings.append(elapsed)
+            else:
+                statements = [s for s in dict.fromkeys(traced) if s.lstrip().upper().startswith(EXPLAINABLE)]
+
+        median = statistics.median(timings)
+        results[name] = round(median, 3)
+        problems = []
+        for statement in statements:
+            plan = _plan(explain, statement)
+            scans = full_scans(statement, plan)
+            if scans:
+                problems.append(f'{"; ".join(scans)} em: {" ".join(statement.split())[:200]}')
+            if args.verbose:
+                print(f'    {" ".join(statement.split())[:160]}')
+                for step in plan:
+                    print(f'      {step}')
+
+        expected = baseline.get(name)
+        if expected is not None and median > expected * args.tolerance and median - expected > MIN_REGRESSION_MS:
+            problems.append(f'regressão: {median:.2f}ms contra baseline {expected:.2f}ms (tolerância {args.tolerance}x)')
+        status = 'FALHOU' if problems else 'ok'
+        reference = f'{expected:9.2f}ms' if expected is not None else '        -  '
+        print(f'{status:6} {name:42} {median:9.2f}ms  baseline {reference}  ({len(statements)} consultas)')
+        for problem in problems:
+            print(f'         {problem}')
+            failures.append((name, problem))
+
+    explain.close()
+    engine.dispose()
+    if not args.only or args.only in 'http':
+        with serve(path) as (client, headers, server_dir):
+            for url in HTTP_BURSTS:
+                failures.extend((f'http {url}', problem) for problem in check_http_load(client, headers, args.concurrency, url))
+            failures.extend(('http PATCH /users', problem) for problem in check_user_patch(client, headers, server_dir))
+    if not args.keep:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(workdir)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({"config": config, "cases": dict(sorted(results.items()))}, f, indent=2)
+            f.write('\n')
+        print(f'Baseline gravada em {args.baseline}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks do crud com verificação de plano de consulta')
+    parser.add_argument('--logs', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=5_000)
+    parser.add_argument('--areas', type=int, default=50)
+    parser.add_argument('--resources', type=int, default=5_000)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--concurrency', type=int, default=2 * READ_POOL_SIZE + 20,
+                        help='requisições simultâneas na verificação HTTP (acima do pool de leitura + overflow)')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--only', help='executa só os casos cujo nome contém este texto')
+    parser.add_argument('--verbose', action='store_true', help='mostra o plano de cada consulta')
+    parser.add_argument('--keep', action='store_true', help='mantém o banco semeado para inspeção')
+    args = parser.parse_args(argv)
+
+    failures = run(args)
+    if failures:
+        print(f'\n{len(failures)} problema(s) encontrados')
+        return 1
+    print('\nTodos os casos dentro dos planos e da baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
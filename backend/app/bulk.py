@@ -0,0 +1,125 @@
+import io
+import os
+import csv
+import json
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from .database import ReadSessionLocal
+
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '1000'))
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(filename: str, requested: str = None):
+    if requested:
+        return requested
+    return 'ndjson' if (filename or '').lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def _check_text(values):
+    """Bytes inválidos chegam como surrogates (surrogateescape) e só falham no encode estrito"""
+    try:
+        for value in values:
+            if isinstance(value, str):
+                value.encode('utf-8')
+    except UnicodeEncodeError:
+        raise ValueError('Line is not valid UTF-8')
+
+
+def iter_records(binary_file, fmt: str):
+    """Lê o arquivo linha a linha, gerando (número da linha, registro ou exceção de parse).
+
+    Erros de decodificação e de CSV viram erro da linha: nada escapa do gerador no meio da
+    importação, depois de lotes anteriores já gravados.
+    """
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', errors='surrogateescape', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield reader.line_num, ValueError(str(exc))
+                continue
+            try:
+                _check_text(list(record.keys()) + list(record.values()))
+            except ValueError as exc:
+                yield reader.line_num, exc
+                continue
+            # Células vazias contam como ausentes (usa o default do schema)
+            yield reader.line_num, {k: v for k, v in record.items() if k and v not in ('', None)}
+    else:
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                _check_text([line])
+                record = json.loads(line)
+                yield line_num, record if isinstance(record, dict) else ValueError('Line must be a JSON object')
+            except ValueError as exc:
+                yield line_num, exc
+
+
+def _errors(exc: Exception):
+    if isinstance(exc, ValidationError):
+        return [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors()]
+    return [str(exc)]
+
+
+def import_records(db: Session, records, schema, model, chunk_size: int = BULK_CHUNK_SIZE):
+    """Valida cada registro com `schema` e insere em lotes (executemany), um commit por lote"""
+    report = {"total": 0, "inserted": 0, "failed": 0, "errors": []}
+    chunk = []
+
+    def flush():
+        db.execute(insert(model), chunk)
+        db.commit()
+        report["inserted"] += len(chunk)
+        chunk.clear()
+
+    for row, record in records:
+        report["total"] += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            chunk.append(schema(**record).dict())
+        except (ValueError, TypeError) as exc:
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": row, "errors": _errors(exc)})
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return report
+
+
+def export_rows(model, fmt: str, chunk_size: int = BULK_CHUNK_SIZE):
+    """Gera o conteúdo CSV/NDJSON da tabela em blocos, com sessão própria (a do request já foi fechada)"""
+    table = model.__table__
+    columns = [c.name for c in table.c]
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(select(table).order_by(table.c.id))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(columns)
+        for partition in result.partitions(chunk_size):
+            for row in partition:
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
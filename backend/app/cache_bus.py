@@ -0,0 +1,126 @@
+import os
+import time
+import sqlite3
+import threading
+import importlib
+from abc import ABC, abstractmethod
+
+# Backend do barramento: 'sqlite' (padrão, multi-worker), 'local' (um único processo)
+# ou 'pacote.modulo:Classe' para uma implementação própria (ex.: Redis)
+CACHE_BUS = os.getenv('CACHE_BUS', 'sqlite')
+CACHE_BUS_PATH = os.getenv('CACHE_BUS_PATH', './cache_bus.db')
+
+
+class InvalidationBus(ABC):
+    """Interface do barramento de invalidação entre workers.
+
+    Cada tópico ('users', 'resources', 'restricted_areas', 'access_logs') tem um número de
+    versão que só cresce. Quem escreve chama publish() depois do commit; quem mantém cache em
+    memória guarda as versões vistas ao calcular e descarta a entrada quando elas mudam.
+    Um backend estilo Redis implementa publish com INCR e versions com MGET; faltando um dos
+    métodos, a classe nem é instanciada (falha na subida, não no primeiro publish).
+    """
+
+    @abstractmethod
+    def publish(self, *topics: str):
+        ...
+
+    @abstractmethod
+    def versions(self, topics) -> tuple:
+        ...
+
+
+class LocalBus(InvalidationBus):
+    """Versões em memória; só é coerente com um único worker"""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def publish(self, *topics):
+        with self._lock:
+            for topic in topics:
+                self._versions[topic] = self._versions.get(topic, 0) + 1
+
+    def versions(self, topics):
+        return tuple(self._versions.get(topic, 0) for topic in topics)
+
+
+class SQLiteVersionBus(InvalidationBus):
+    """Versões numa tabela SQLite compartilhada (arquivo próprio, em WAL, fora do banco principal)"""
+
+    def __init__(self, path: str = CACHE_BUS_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_versions (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def publish(self, *topics):
+        self._connection().executemany(
+            'INSERT INTO cache_versions (topic, version) VALUES (?, 1) '
+            'ON CONFLICT(topic) DO UPDATE SET version = version + 1',
+            [(topic,) for topic in topics],
+        )
+
+    def versions(self, topics):
+        placeholders = ', '.join('?' for _ in topics)
+        rows = dict(self._connection().execute(
+            f'SELECT topic, version FROM cache_versions WHERE topic IN ({placeholders})', tuple(topics)
+        ).fetchall())
+        return tuple(rows.get(topic, 0) for topic in topics)
+
+
+def get_bus(name: str = CACHE_BUS) -> InvalidationBus:
+    if name == 'sqlite':
+        return SQLiteVersionBus()
+    if name == 'local':
+        return LocalBus()
+    module, _, cls = name.partition(':')
+    bus_class = getattr(importlib.import_module(module), cls)
+    # Só subclasses passam pela checagem dos métodos abstratos ao instanciar
+    if not (isinstance(bus_class, type) and issubclass(bus_class, InvalidationBus)):
+        raise TypeError(f'CACHE_BUS={name} precisa estender cache_bus.InvalidationBus')
+    return bus_class()
+
+
+bus = get_bus()
+
+
+class VersionedCache:
+    """Cache em memória cujas entradas valem enquanto as versões dos tópicos não mudarem (e até o TTL)"""
+
+    def __init__(self, topics, ttl: int, max_entries: int = 64):
+        self.topics = tuple(topics)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        # Versões lidas antes de calcular: uma escrita concorrente invalida o resultado na próxima leitura
+        versions = bus.versions(self.topics)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == versions and entry[1] > now:
+                return entry[2]
+        result = compute()
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                stale = [k for k, (v, expires, _) in self._entries.items() if v != versions or expires <= now]
+                for k in stale or [next(iter(self._entries))]:
+                    del self._entries[k]
+            self._entries[key] = (versions, now + self.ttl, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,368 @@
+"""Armazenamento colunar dos logs de acesso para as agregações (analytics e dashboard).
+
+O SQLite continua sendo a fonte da verdade. A cada COLUMNAR_SEGMENT_ROWS logs gravados, o
+caminho de escrita sela o próximo intervalo de ids em um segmento imutável: um arquivo binário
+de largura fixa por coluna, ordenado por horário, lido com numpy.memmap sem cópia. Os logs
+ainda não selados (id > sealed_max_id) formam uma cauda pequena lida por SQL.
+
+    <diretório>/manifest.json        segmentos, maior id selado e dicionários de status/tipo
+    <diretório>/seg-<id>.<coluna>    colunas de um segmento (id, user_id, area_id, ts, status, access_type)
+    <diretório>/tombstones.bin       ids selados que foram excluídos depois
+"""
+import os
+import sys
+import copy
+import json
+import time
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy.orm import Session
+from .database import SQLALCHEMY_DATABASE_URL
+
+# Desativado quando vazio; com um diretório, analytics e dashboard leem os segmentos
+COLUMNAR_STORE_DIR = os.getenv('COLUMNAR_STORE_DIR', '')
+COLUMNAR_SEGMENT_ROWS = int(os.getenv('COLUMNAR_SEGMENT_ROWS', '65536'))
+
+EPOCH = datetime(1970, 1, 1)
+LOCK_STALE_SECONDS = 120
+
+COLUMNS = {
+    'id': np.int64,
+    'user_id': np.int32,
+    'area_id': np.int32,
+    'ts': np.int64,          # segundos desde a época (UTC)
+    'status': np.uint8,      # código no dicionário 'status'
+    'access_type': np.uint8,  # código no dicionário 'access_type'
+}
+ENCODED = ('status', 'access_type')
+
+SEAL_SQL = """
+    SELECT id, COALESCE(user_id, 0), COALESCE(area_id, 0),
+           COALESCE(CAST(strftime('%s', access_time) AS INTEGER), 0), status, access_type
+    FROM access_logs
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+TAIL_SQL = """
+    SELECT id, COALESCE(user_id, 0), COALESCE(area_id, 0),
+           CAST(strftime('%s', access_time) AS INTEGER), status = 'denied', access_type = 'exit'
+    FROM access_logs
+    WHERE id > ? AND access_time >= ? AND access_time < ?
+"""
+
+TAIL_DENIED_SQL = "SELECT COUNT(*) FROM access_logs WHERE id > ? AND status = 'denied'"
+
+
+def _timestamp(value: datetime) -> int:
+    return int((value - EPOCH).total_seconds())
+
+
+class SegmentStore:
+    """Segmentos colunares append-only de um diretório, compartilhados entre workers"""
+
+    def __init__(self, directory: str, segment_rows: int = COLUMNAR_SEGMENT_ROWS, base_id: int = 0):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        # Ids do banco começam acima de base_id (shards: k << SHARD_ID_BITS)
+        self.base_id = base_id
+        # Menor id gravado que justifica nova tentativa depois de uma selagem sem segmento completo
+        self._next_seal_id = 0
+        self._manifest = None
+        self._manifest_mtime = None
+        self._segments = {}  # nome -> colunas (memmap) do segmento
+        self._tombstones = (0, np.empty(0, dtype=np.int64))
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, name)
+
+    # --- leitura -----------------------------------------------------------
+
+    def manifest(self):
+        """Manifesto atual, relido só quando outro worker o substitui"""
+        path = self._path('manifest.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {"sealed_max_id": self.base_id, "segments": [], "dictionaries": {name: [] for name in ENCODED}}
+        with self._lock:
+            if mtime != self._manifest_mtime:
+                with open(path, encoding='utf-8') as f:
+                    self._manifest, self._manifest_mtime = json.load(f), mtime
+            return self._manifest
+
+    def sealed_max_id(self) -> int:
+        return self.manifest()["sealed_max_id"]
+
+    def code(self, column: str, value: str, manifest=None) -> int:
+        """Código de `value` no dicionário da coluna, ou -1 se nunca apareceu"""
+        values = (manifest or self.manifest())["dictionaries"][column]
+        return values.index(value) if value in values else -1
+
+    def _columns(self, segment):
+        name = segment["name"]
+        columns = self._segments.get(name)
+        if columns is None:
+            columns = {
+                column: np.memmap(self._path(f'{name}.{column}'), dtype=dtype, mode='r', shape=(segment["rows"],))
+                for column, dtype in COLUMNS.items()
+            }
+            self._segments[name] = columns
+        return columns
+
+    def tombstones(self) -> np.ndarray:
+        path = self._path('tombstones.bin')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size != self._tombstones[0]:
+            self._tombstones = (size, np.unique(np.fromfile(path, dtype=np.int64)))
+        return self._tombstones[1]
+
+    def scan(self, start_ts: int = None, end_ts: int = None, columns=tuple(COLUMNS), manifest=None):
+        """Colunas dos logs selados com ts em [start_ts, end_ts).
+
+        Cada segmento é ordenado por ts, então o recorte é uma busca binária e o resultado de um
+        único segmento é uma view do memmap; vários segmentos são concatenados. Quem combina com a
+        cauda SQL passa o mesmo `manifest` usado para ler sealed_max_id.
+        """
+        parts = []
+        for segment in (manifest or self.manifest())["segments"]:
+            if (start_ts is not None and segment["max_ts"] < start_ts) or (end_ts is not None and segment["min_ts"] >= end_ts):
+                continue
+            data = self._columns(segment)
+            lo = 0 if start_ts is None else int(np.searchsorted(data['ts'], start_ts, side='left'))
+            hi = segment["rows"] if end_ts is None else int(np.searchsorted(data['ts'], end_ts, side='left'))
+            if hi > lo:
+                parts.append({column: data[column][lo:hi] for column in set(columns) | {'id'}})
+
+        if not parts:
+            result = {column: np.empty(0, dtype=COLUMNS[column]) for column in set(columns) | {'id'}}
+        elif len(parts) == 1:
+            result = parts[0]
+        else:
+            result = {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+
+        tombstones = self.tombstones()
+        if tombstones.size:
+            keep = ~np.isin(result['id'], tombstones, assume_unique=False)
+            if not keep.all():
+                result = {column: values[keep] for column, values in result.items()}
+        return result
+
+    # --- escrita -----------------------------------------------------------
+
+    def _acquire(self):
+        """Lock entre processos por arquivo exclusivo (portável, sem fcntl)"""
+        path = self._path('.seal.lock')
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(path).st_mtime < LOCK_STALE_SECONDS:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return self._acquire()
+        os.close(fd)
+        return True
+
+    def _release(self):
+        try:
+            os.remove(self._path('.seal.lock'))
+        except FileNotFoundError:
+            pass
+
+    def _write_manifest(self, manifest):
+        tmp = self._path('manifest.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._path('manifest.json'))
+
+    def seal(self, db: Session) -> int:
+        """Sela em segmentos os logs após sealed_max_id, um segmento por COLUMNAR_SEGMENT_ROWS logs.
+
+        Só sela segmentos completos; o resto fica na cauda. Com AUTOINCREMENT em access_logs os
+        ids nunca são reaproveitados, então o intervalo selado não muda depois de gravado.
+        Retorna o número de segmentos criados.
+        """
+        if not self._acquire():
+            return 0  # outro worker está selando
+        try:
+            manifest = copy.deepcopy(self.manifest())
+            dictionaries = manifest["dictionaries"]
+            created = 0
+            # Conexão própria: não mexe na transação nem nos objetos da sessão de quem chamou
+            connection = db.get_bind().connect()
+            cursor = connection.connection.cursor()
+            try:
+                while True:
+                    cursor.execute(SEAL_SQL, (manifest["sealed_max_id"], self.segment_rows))
+                    rows = cursor.fetchall()
+                    if len(rows) < self.segment_rows:
+                        # Ids excluídos abrem buracos: espera os logs que faltam para completar o segmento
+                        last = int(rows[-1][0]) if rows else manifest["sealed_max_id"]
+                        self._next_seal_id = last + self.segment_rows - len(rows)
+                        break
+                    ids, user_ids, area_ids, ts, statuses, types = zip(*rows)
+                    data = {
+                        'id': np.array(ids, dtype=np.int64),
+                        'user_id': np.array(user_ids, dtype=np.int32),
+                        'area_id': np.array(area_ids, dtype=np.int32),
+                        'ts': np.array(ts, dtype=np.int64),
+                    }
+                    for column, raw in (('status', statuses), ('access_type', types)):
+                        values = dictionaries[column]
+                        codes = {value: index for index, value in enumerate(values)}
+                        for value in set(raw) - codes.keys():
+                            codes[value] = len(values)
+                            values.append(value)
+                        data[column] = np.array([codes[value] for value in raw], dtype=np.uint8)
+
+                    order = np.lexsort((data['id'], data['ts']))
+                    name = f'seg-{int(data["id"][0]):012d}'
+                    for column, dtype in COLUMNS.items():
+                        data[column][order].astype(dtype).tofile(self._path(f'{name}.{column}'))
+                    manifest["segments"].append({
+                        "name": name,
+                        "rows": len(rows),
+                        "min_id": int(data['id'][0]),
+                        "max_id": int(data['id'][-1]),
+                        "min_ts": int(data['ts'].min()),
+                        "max_ts": int(data['ts'].max()),
+                    })
+                    manifest["sealed_max_id"] = int(data['id'][-1])
+                    self._write_manifest(manifest)
+                    created += 1
+            finally:
+                cursor.close()
+                connection.close()
+            return created
+        finally:
+            self._release()
+
+    def maybe_seal(self, db: Session, last_id: int):
+        """Chamado pelo caminho de escrita após o commit com o maior id gravado"""
+        if last_id - self.sealed_max_id() >= self.segment_rows and last_id >= self._next_seal_id:
+            self.seal(db)
+
+    def forget(self, log_id: int):
+        """Registra a exclusão de um log já selado (os segmentos são imutáveis)"""
+        if log_id <= self.sealed_max_id():
+            with open(self._path('tombstones.bin'), 'ab') as f:
+                f.write(np.array([log_id], dtype=np.int64).tobytes())
+
+    def reset(self):
+        """Apaga todos os segmentos (banco recriado)"""
+        with self._lock:
+            self._segments.clear()
+            self._manifest = self._manifest_mtime = None
+            self._tombstones = (0, np.empty(0, dtype=np.int64))
+        for name in os.listdir(self.directory):
+            if name.startswith('seg-') or name in ('manifest.json', 'tombstones.bin'):
+                os.remove(self._path(name))
+
+
+# Banco principal no diretório raiz; cada shard de logs (sharding.py) num subdiretório
+store = SegmentStore(COLUMNAR_STORE_DIR) if COLUMNAR_STORE_DIR else None
+_shard_stores = {}
+_shard_stores_lock = threading.Lock()
+
+
+def _database_path(bind) -> str:
+    # O engine de leitura abre o mesmo arquivo como URI (file:...?mode=ro)
+    return os.path.abspath((bind.url.database or '').removeprefix('file:').split('?')[0])
+
+
+MAIN_DATABASE_PATH = os.path.abspath(SQLALCHEMY_DATABASE_URL[len("sqlite:///"):])
+
+
+def _shard_store(path: str, base_id: int = 0):
+    with _shard_stores_lock:
+        if path not in _shard_stores:
+            name = os.path.splitext(os.path.basename(path))[0]
+            _shard_stores[path] = SegmentStore(os.path.join(COLUMNAR_STORE_DIR, 'shards', name), base_id=base_id)
+        return _shard_stores[path]
+
+
+def register_shard(bind, base_id: int):
+    """Cria o store de um shard com a marca d'água inicial na faixa de ids dele (sharding._prepare)"""
+    if store is not None:
+        _shard_store(_database_path(bind), base_id)
+
+
+def store_for(bind):
+    """Store dos logs gravados no banco de `bind` (engine ou conexão), ou None se desativado"""
+    if store is None:
+        return None
+    path = _database_path(bind)
+    if path == MAIN_DATABASE_PATH:
+        return store
+    return _shard_store(path)
+
+
+def _fetch_tail(db: Session, sql: str, params: tuple):
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def load_window(db: Session, start: datetime, end: datetime, segments: SegmentStore):
+    """Logs em [start, end) no formato de analytics.load_access_window: segmentos + cauda SQL"""
+    manifest = segments.manifest()
+    sealed = segments.scan(_timestamp(start), _timestamp(end), manifest=manifest)
+    tail = np.array(
+        _fetch_tail(db, TAIL_SQL, (manifest["sealed_max_id"], start.isoformat(sep=' '), end.isoformat(sep=' '))),
+        dtype=np.int64,
+    ).reshape(-1, 6)
+
+    def column(values, tail_values):
+        if not tail.size:
+            return np.asarray(values, dtype=tail_values.dtype)
+        return np.concatenate([values.astype(tail_values.dtype), tail_values])
+
+    return {
+        'id': column(sealed['id'], tail[:, 0]),
+        'user_id': column(sealed['user_id'], tail[:, 1]),
+        'area_id': column(sealed['area_id'], tail[:, 2]),
+        'ts': column(sealed['ts'], tail[:, 3]),
+        'denied': column(sealed['status'] == segments.code('status', 'denied', manifest), tail[:, 4].astype(bool)),
+        'exit': column(sealed['access_type'] == segments.code('access_type', 'exit', manifest), tail[:, 5].astype(bool)),
+    }
+
+
+def count_denied(db: Session, segments: SegmentStore) -> int:
+    """Total de acessos negados: varredura da coluna status dos segmentos + contagem da cauda"""
+    manifest = segments.manifest()
+    sealed = segments.scan(columns=('status',), manifest=manifest)
+    tail = _fetch_tail(db, TAIL_DENIED_SQL, (manifest["sealed_max_id"],))[0][0]
+    return int(np.count_nonzero(sealed['status'] == segments.code('status', 'denied', manifest))) + tail
+
+
+def rebuild():
+    """Recria todos os segmentos a partir do banco principal e dos shards: python -m app.columnar"""
+    from . import sharding
+    if store is None:
+        print('Defina COLUMNAR_STORE_DIR para ativar o armazenamento colunar')
+        return 1
+    for shard in sharding.shards():
+        segments = store_for(shard.engine)
+        segments.reset()
+        db = shard.SessionLocal()
+        try:
+            created = segments.seal(db)
+        finally:
+            db.close()
+        manifest = segments.manifest()
+        print(f'{created} segmento(s) selados até o id {manifest["sealed_max_id"]} em {segments.directory}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(rebuild())
@@ -1,18 +1,38 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.context import CryptContext
+from sqlalchemy.orm import Session, selectinload
+from . import models, schemas, columnar, hashing
+from .database import MARK_ROLLUP_VECTORS_IF_EMPTY
 from datetime import datetime, timedelta
+from typing import Optional
+import re
 import uuid
-from sqlalchemy import func
+import numpy as np
+from sqlalchemy import func, table, column, literal_column, delete, select, case, literal, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Atualização parcial com controle otimista de concorrência (coluna version)
+def patch_row(db: Session, model, row_id: int, changes: dict, expected_version: Optional[int] = None):
+    """UPDATE ... WHERE id=? [AND version=?] só com as colunas alteradas, em uma ida ao banco.
+
+    Retorna a linha atualizada (via RETURNING) ou None se o id não existe ou a versão mudou.
+    """
+    table_ = model.__table__
+    stmt = update(table_).where(table_.c.id == row_id)
+    if expected_version is not None:
+        stmt = stmt.where(table_.c.version == expected_version)
+    values = dict(changes, version=table_.c.version + 1)
+    if 'updated_at' in table_.c:
+        values['updated_at'] = datetime.utcnow()
+    row = db.execute(stmt.values(**values).returning(*table_.c)).mappings().first()
+    db.commit()
+    return dict(row) if row else None
 
 # Funções para Usuários
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    hashed = pwd_context.hash(user.password)
+    hashed = hashing.hash_password(user.password)
     db_user = models.User(
         username=user.username, 
         email=user.email, 
@@ -28,6 +48,13 @@ def create_user(db: Session, user: schemas.UserCreate):
 def list_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
+def patch_user(db: Session, user_id: int, user: schemas.UserPatch, expected_version: Optional[int] = None):
+    changes = user.dict(exclude_unset=True)
+    password = changes.pop('password', None)
+    if password:
+        changes['hashed_password'] = hashing.hash_password(password)
+    return patch_row(db, models.User, user_id, changes, expected_version)
+
 # Funções para Recursos
 def create_resource(db: Session, resource: schemas.ResourceCreate):
     db_res = models.Resource(
@@ -42,8 +69,43 @@ def create_resource(db: Session, resource: schemas.ResourceCreate):
     db.refresh(db_res)
     return db_res
 
-def list_resources(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Resource).offset(skip).limit(limit).all()
+def _filter_resources(query, resource_type: Optional[str], status: Optional[str], location: Optional[str]):
+    if resource_type:
+        query = query.filter(models.Resource.type == resource_type)
+    if status:
+        query = query.filter(models.Resource.status == status)
+    if location:
+        query = query.filter(models.Resource.location == location)
+    return query
+
+def list_resources(db: Session, skip: int = 0, limit: int = 100, resource_type: Optional[str] = None,
+                   status: Optional[str] = None, location: Optional[str] = None):
+    query = _filter_resources(db.query(models.Resource), resource_type, status, location)
+    return query.order_by(models.Resource.id).offset(skip).limit(limit).all()
+
+# Tabela virtual FTS5 criada em models.RESOURCE_FTS_DDL (fora do metadata)
+resources_fts = table('resources_fts', column('rowid'))
+
+def _fts_query(search: str):
+    # Cada termo vira uma frase entre aspas (sem sintaxe FTS do usuário); o último casa por prefixo
+    terms = re.findall(r'\w+', search)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def search_resources(db: Session, search: str, skip: int = 0, limit: int = 100, resource_type: Optional[str] = None,
+                     status: Optional[str] = None, location: Optional[str] = None):
+    """Busca full-text em nome, detalhes e localização, ordenada por relevância (bm25)"""
+    match = _fts_query(search)
+    if match is None:
+        return []
+    fts = literal_column('resources_fts')
+    query = db.query(models.Resource)\
+        .join(resources_fts, resources_fts.c.rowid == models.Resource.id)\
+        .filter(fts.op('MATCH')(match))
+    query = _filter_resources(query, resource_type, status, location)
+    # Pesos por coluna: name, details, location
+    return query.order_by(func.bm25(fts, 10.0, 1.0, 3.0)).offset(skip).limit(limit).all()
 
 def get_resource(db: Session, resource_id: int):
     return db.query(models.Resource).filter(models.Resource.id == resource_id).first()
@@ -54,10 +116,14 @@ def update_resource(db: Session, resource_id: int, resource: schemas.ResourceCre
         return None
     for key, val in resource.dict().items():
         setattr(db_res, key, val)
+    db_res.version = models.Resource.version + 1
     db.commit()
     db.refresh(db_res)
     return db_res
 
+def patch_resource(db: Session, resource_id: int, resource: schemas.ResourcePatch, expected_version: Optional[int] = None):
+    return patch_row(db, models.Resource, resource_id, resource.dict(exclude_unset=True), expected_version)
+
 def delete_resource(db: Session, resource_id: int):
     db_res = get_resource(db, resource_id)
     if db_res:
@@ -100,12 +166,41 @@ def create_restricted_area(db: Session, area: schemas.RestrictedAreaCreate):
     db.refresh(db_area)
     return db_area
 
-def get_restricted_areas(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.RestrictedArea).offset(skip).limit(limit).all()
+def attach_member_counts(db: Session, areas):
+    """Preenche area.member_count com uma única consulta agrupada (sem carregar os membros)"""
+    uaa = models.user_accessible_areas
+    ids = [area.id for area in areas]
+    counts = dict(
+        db.query(uaa.c.area_id, func.count()).filter(uaa.c.area_id.in_(ids)).group_by(uaa.c.area_id).all()
+    ) if ids else {}
+    for area in areas:
+        area.member_count = counts.get(area.id, 0)
+    return areas
+
+def get_restricted_areas(db: Session, skip: int = 0, limit: int = 100, include_members: bool = False):
+    query = db.query(models.RestrictedArea).order_by(models.RestrictedArea.id)
+    if include_members:
+        query = query.options(selectinload(models.RestrictedArea.authorized_users))
+    return attach_member_counts(db, query.offset(skip).limit(limit).all())
 
 def get_restricted_area(db: Session, area_id: int):
     return db.query(models.RestrictedArea).filter(models.RestrictedArea.id == area_id).first()
 
+def get_area_members(db: Session, area_id: int, skip: int = 0, limit: int = 100, search: Optional[str] = None):
+    """Página de usuários autorizados na área, com busca por username, nome ou e-mail"""
+    uaa = models.user_accessible_areas
+    query = db.query(models.User).join(uaa, uaa.c.user_id == models.User.id).filter(uaa.c.area_id == area_id)
+    if search:
+        pattern = f"%{search}%"
+        query = query.filter(
+            models.User.username.ilike(pattern)
+            | models.User.full_name.ilike(pattern)
+            | models.User.email.ilike(pattern)
+        )
+    total = query.order_by(None).count()
+    items = query.order_by(models.User.username, models.User.id).offset(skip).limit(limit).all()
+    return {"total": total, "items": items}
+
 def grant_area_access(db: Session, user_id: int, area_id: int):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     area = db.query(models.RestrictedArea).filter(models.RestrictedArea.id == area_id).first()
@@ -126,39 +221,219 @@ def revoke_area_access(db: Session, user_id: int, area_id: int):
     
     return area
 
+# Funções para Agregados de Acesso (access_log_rollups)
+ROLLUP_GRANULARITIES = {
+    'hour': lambda t: t.replace(minute=0, second=0, microsecond=0),
+    'day': lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+def update_access_rollups(db: Session, logs, delta: int = 1):
+    """Soma (ou subtrai, com delta=-1) os logs nos agregados por hora e por dia, sem commit"""
+    counts = {}
+    for log in logs:
+        if log.area_id is None:
+            continue
+        denied = 1 if log.status == 'denied' else 0
+        for granularity, truncate in ROLLUP_GRANULARITIES.items():
+            key = (granularity, truncate(log.access_time), log.area_id)
+            granted_count, denied_count = counts.get(key, (0, 0))
+            counts[key] = (granted_count + (1 - denied) * delta, denied_count + denied * delta)
+    if not counts:
+        return
+    rollup = models.AccessLogRollup
+    stmt = sqlite_insert(rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rollup.granularity, rollup.bucket_start, rollup.area_id],
+        set_={"granted": rollup.granted + stmt.excluded.granted, "denied": rollup.denied + stmt.excluded.denied},
+    )
+    db.execute(stmt, [
+        {"granularity": g, "bucket_start": b, "area_id": a, "granted": granted, "denied": denied}
+        for (g, b, a), (granted, denied) in counts.items()
+    ])
+    # Vetores empacotados dos intervalos tocados ficam desatualizados até a próxima leitura do heatmap
+    vector = models.AccessLogRollupVector
+    stale = sqlite_insert(vector)
+    stale = stale.on_conflict_do_update(
+        index_elements=[vector.granularity, vector.bucket_start],
+        set_={"version": vector.version + 1, "area_ids": None, "granted": None, "denied": None},
+    )
+    db.execute(stale, [{"granularity": g, "bucket_start": b, "version": 1} for g, b in {(g, b) for g, b, _ in counts}])
+
+def rebuild_access_rollups(db: Session):
+    """Recalcula todos os agregados a partir de access_logs e marca o backfill como concluído.
+
+    Uma única transação: escritas concorrentes esperam o lock e somam nos agregados já refeitos.
+    """
+    log = models.AccessLog
+    db.execute(delete(models.AccessLogRollup))
+    db.execute(delete(models.AccessLogRollupVector))
+    buckets = {'hour': func.strftime('%Y-%m-%d %H:00:00.000000', log.access_time),
+               'day': func.strftime('%Y-%m-%d 00:00:00.000000', log.access_time)}
+    for granularity, bucket in buckets.items():
+        grouped = select(
+            literal(granularity), bucket, log.area_id,
+            func.sum(case((log.status == 'denied', 0), else_=1)),
+            func.sum(case((log.status == 'denied', 1), else_=0)),
+        ).where(log.area_id.isnot(None)).group_by(bucket, log.area_id)
+        db.execute(models.AccessLogRollup.__table__.insert().from_select(
+            ['granularity', 'bucket_start', 'area_id', 'granted', 'denied'], grouped))
+    db.execute(MARK_ROLLUP_VECTORS_IF_EMPTY)
+    db.merge(models.AccessLogRollupState(id=1, backfilled_at=datetime.utcnow()))
+    db.commit()
+
 # Funções para Logs de Acesso
 def create_access_log(db: Session, access_log: schemas.AccessLogCreate):
     db_log = models.AccessLog(
         user_id=access_log.user_id,
         area_id=access_log.area_id,
+        access_time=datetime.utcnow(),
         access_type=access_log.access_type,
         status=access_log.status
     )
     db.add(db_log)
+    update_access_rollups(db, [db_log])
     db.commit()
     db.refresh(db_log)
+    store = columnar.store_for(db.get_bind())
+    if store:
+        store.maybe_seal(db, db_log.id)
     return db_log
 
+# Funções para Controladores de Ingestão
+def get_ingest_controller(db: Session, controller_id: str):
+    return db.get(models.IngestController, controller_id)
+
+def list_ingest_controllers(db: Session):
+    return db.query(models.IngestController).order_by(models.IngestController.controller_id).all()
+
+def create_ingest_controller(db: Session, controller: schemas.IngestControllerCreate):
+    db_controller = models.IngestController(controller_id=controller.controller_id, owner_id=controller.owner_id)
+    db.add(db_controller)
+    db.commit()
+    db.refresh(db_controller)
+    return db_controller
+
+def delete_ingest_controller(db: Session, controller_id: str):
+    db_controller = get_ingest_controller(db, controller_id)
+    if db_controller:
+        db.delete(db_controller)
+        db.commit()
+    return db_controller
+
+def get_ingest_cursor(db: Session, controller_id: str):
+    cursor = db.get(models.IngestCursor, controller_id)
+    return cursor.last_seq if cursor else 0
+
+def ingest_access_logs(db: Session, controller_id: str, events, max_seq: int):
+    """Grava em uma transação os eventos ainda não vistos do controlador e avança seu cursor até max_seq.
+
+    Eventos com seq <= cursor já foram gravados (replay após reconexão) e são ignorados.
+    Retorna (último seq confirmado, quantidade de logs inseridos).
+    """
+    last_seq = get_ingest_cursor(db, controller_id)
+    if max_seq <= last_seq:
+        return last_seq, 0
+    now = datetime.utcnow()
+    fresh = {}
+    for event in events:
+        if event.seq > last_seq:
+            fresh[event.seq] = event
+    logs = [
+        models.AccessLog(
+            user_id=event.user_id,
+            area_id=event.area_id,
+            access_time=event.access_time or now,
+            access_type=event.access_type,
+            status=event.status,
+        )
+        for _, event in sorted(fresh.items())
+    ]
+    if logs:
+        db.execute(insert(models.AccessLog), [
+            {"user_id": log.user_id, "area_id": log.area_id, "access_time": log.access_time,
+             "access_type": log.access_type, "status": log.status}
+            for log in logs
+        ])
+        update_access_rollups(db, logs)
+    cursor = sqlite_insert(models.IngestCursor).values(controller_id=controller_id, last_seq=max_seq, updated_at=now)
+    db.execute(cursor.on_conflict_do_update(
+        index_elements=[models.IngestCursor.controller_id],
+        set_={"last_seq": max_seq, "updated_at": now},
+    ))
+    db.commit()
+    store = columnar.store_for(db.get_bind())
+    if logs and store:
+        store.maybe_seal(db, db.execute(select(func.max(models.AccessLog.id))).scalar())
+    return max_seq, len(logs)
+
 def get_access_logs(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.AccessLog).order_by(models.AccessLog.access_time.desc()).offset(skip).limit(limit).all()
 
+def get_access_log(db: Session, log_id: int):
+    return db.query(models.AccessLog).filter(models.AccessLog.id == log_id).first()
+
+def get_user_access_logs(db: Session, user_id: int, skip: int = 0, limit: int = 100):
+    return db.query(models.AccessLog)\
+        .filter(models.AccessLog.user_id == user_id)\
+        .order_by(models.AccessLog.access_time.desc())\
+        .offset(skip)\
+        .limit(limit)\
+        .all()
+
+def delete_access_log(db: Session, log_id: int):
+    db_log = db.query(models.AccessLog).filter(models.AccessLog.id == log_id).first()
+    if db_log:
+        update_access_rollups(db, [db_log], delta=-1)
+        db.delete(db_log)
+        db.commit()
+        store = columnar.store_for(db.get_bind())
+        if store:
+            store.forget(log_id)
+    return db_log
+
 # Funções para Dashboard
-def get_dashboard_stats(db: Session):
+def get_access_log_stats(db: Session):
+    """Contagens de logs do dashboard em um banco de logs (somadas entre shards pelo chamador)"""
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    store = columnar.store_for(db.get_bind())
+    if store:
+        # Agregações sobre as colunas dos segmentos (memmap) + cauda ainda não selada
+        window = columnar.load_window(db, yesterday, datetime.max, store)
+        recent_access_logs = int(window['id'].size)
+        security_incidents = columnar.count_denied(db, store)
+        hours = np.bincount(window['ts'] % 86400 // 3600, minlength=24)
+        access_by_hour_dict = {hour: int(count) for hour, count in enumerate(hours) if count}
+    else:
+        # Logs das últimas 24 horas
+        recent_access_logs = db.query(models.AccessLog).filter(
+            models.AccessLog.access_time >= yesterday
+        ).count()
+        
+        # Incidentes de segurança (acessos negados)
+        security_incidents = db.query(models.AccessLog).filter(
+            models.AccessLog.status == "denied"
+        ).count()
+        
+        # Acessos por hora (últimas 24h)
+        access_by_hour = db.query(
+            func.extract('hour', models.AccessLog.access_time).label('hour'),
+            func.count(models.AccessLog.id)
+        ).filter(
+            models.AccessLog.access_time >= yesterday
+        ).group_by('hour').all()
+        access_by_hour_dict = {int(hour): count for hour, count in access_by_hour}
+
+    return {
+        "recent_access_logs": recent_access_logs,
+        "security_incidents": security_incidents,
+        "access_by_hour": access_by_hour_dict
+    }
+
+def get_dashboard_stats(db: Session, log_stats=None):
     total_users = db.query(models.User).count()
     total_resources = db.query(models.Resource).count()
     total_restricted_areas = db.query(models.RestrictedArea).count()
     
-    # Logs das últimas 24 horas
-    yesterday = datetime.utcnow() - timedelta(days=1)
-    recent_access_logs = db.query(models.AccessLog).filter(
-        models.AccessLog.access_time >= yesterday
-    ).count()
-    
-    # Incidentes de segurança (acessos negados)
-    security_incidents = db.query(models.AccessLog).filter(
-        models.AccessLog.status == "denied"
-    ).count()
-    
     # Recursos por tipo
     resources_by_type = db.query(
         models.Resource.type, 
@@ -166,21 +441,20 @@ def get_dashboard_stats(db: Session):
     ).group_by(models.Resource.type).all()
     resources_by_type_dict = {rtype: count for rtype, count in resources_by_type}
     
-    # Acessos por hora (últimas 24h)
-    access_by_hour = db.query(
-        func.extract('hour', models.AccessLog.access_time).label('hour'),
-        func.count(models.AccessLog.id)
-    ).filter(
-        models.AccessLog.access_time >= yesterday
-    ).group_by('hour').all()
-    access_by_hour_dict = {int(hour): count for hour, count in access_by_hour}
+    # Logs: um item por shard (sharding.scatter) ou só o banco principal
+    if log_stats is None:
+        log_stats = [get_access_log_stats(db)]
+    access_by_hour_dict = {}
+    for stats in log_stats:
+        for hour, count in stats["access_by_hour"].items():
+            access_by_hour_dict[hour] = access_by_hour_dict.get(hour, 0) + count
     
     return {
         "total_users": total_users,
         "total_resources": total_resources,
         "total_restricted_areas": total_restricted_areas,
-        "recent_access_logs": recent_access_logs,
-        "security_incidents": security_incidents,
+        "recent_access_logs": sum(stats["recent_access_logs"] for stats in log_stats),
+        "security_incidents": sum(stats["security_incidents"] for stats in log_stats),
         "resources_by_type": resources_by_type_dict,
         "access_by_hour": access_by_hour_dict
-    }
\ No newline at end of file
+    }
@@ -1,12 +1,123 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./wayne_security.db"
+# Réplica de leitura para bancos servidor; sem ela, o SQLite é aberto em modo somente leitura
+READ_DATABASE_URL = os.getenv('READ_DATABASE_URL')
+READ_POOL_SIZE = int(os.getenv('READ_POOL_SIZE', '10'))
+
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def _enable_wal(dbapi_connection, connection_record):
+    # WAL permite leitores concorrentes com o único escritor do SQLite
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+if READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, pool_size=READ_POOL_SIZE)
+else:
+    database_path = SQLALCHEMY_DATABASE_URL[len("sqlite:///"):]
+    read_engine = create_engine(
+        f"sqlite:///file:{database_path}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False},
+        pool_size=READ_POOL_SIZE,
+    )
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
+# Agregados de um banco sem logs já estão completos; com logs, só depois do backfill (python -m app.rollups)
+MARK_ROLLUPS_IF_EMPTY = text(
+    "INSERT OR IGNORE INTO access_log_rollup_state (id, backfilled_at) "
+    "SELECT 1, CURRENT_TIMESTAMP WHERE NOT EXISTS (SELECT 1 FROM access_logs)"
+)
+
+# Vetores do heatmap (ainda não empacotados) para os intervalos dos agregados, quando ainda não há
+# nenhum: bancos com agregados anteriores aos vetores e o fim do backfill
+MARK_ROLLUP_VECTORS_IF_EMPTY = text(
+    "INSERT INTO access_log_rollup_vectors (granularity, bucket_start, version) "
+    "SELECT DISTINCT granularity, bucket_start, 1 FROM access_log_rollups "
+    "WHERE NOT EXISTS (SELECT 1 FROM access_log_rollup_vectors)"
+)
+
 # Função para recriar o banco de dados
 def recreate_database():
     Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(MARK_ROLLUPS_IF_EMPTY)
+
+
+def _column_ddl(column, dialect):
+    """Definição para ALTER TABLE ADD COLUMN; colunas NOT NULL precisam de um default escalar"""
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    if not column.nullable:
+        if column.default is None or not column.default.is_scalar:
+            raise RuntimeError(f'Coluna {column.table.name}.{column.name} é NOT NULL sem default escalar; migre manualmente')
+        ddl += f' NOT NULL DEFAULT {int(column.default.arg) if isinstance(column.default.arg, bool) else repr(column.default.arg)}'
+    return ddl
+
+
+def _rebuild_access_logs(conn):
+    """Recria access_logs com AUTOINCREMENT (bancos anteriores reaproveitariam ids excluídos)"""
+    from .models import AccessLog
+    table = AccessLog.__table__
+    columns = ', '.join(column.name for column in table.columns)
+    conn.execute(text('ALTER TABLE access_logs RENAME TO access_logs_old'))
+    for (name,) in conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'access_logs_old' AND sql IS NOT NULL"
+    )).all():
+        conn.execute(text(f'DROP INDEX {name}'))
+    table.create(bind=conn)
+    conn.execute(text(f'INSERT INTO access_logs ({columns}) SELECT {columns} FROM access_logs_old'))
+    conn.execute(text('DROP TABLE access_logs_old'))
+
+
+def upgrade_database():
+    """Atualiza o esquema de um banco existente sem apagar dados (executado na subida da API).
+
+    Só faz mudanças aditivas: tabelas e índices que faltam, colunas novas (ALTER TABLE ADD COLUMN
+    com o default do modelo), o índice FTS de recursos e o AUTOINCREMENT de access_logs. O backfill
+    dos agregados de logs antigos pode demorar e fica a cargo de `python -m app.rollups`.
+    Também disponível como `python -m app.database`.
+    """
+    from . import models
+    # Metadata dos modelos: com `python -m app.database` este módulo roda como __main__, com outro Base
+    metadata = models.Base.metadata
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing = set(inspector.get_table_names())
+        if 'access_logs' in existing:
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'access_logs'")).scalar()
+            if 'AUTOINCREMENT' not in sql.upper():
+                _rebuild_access_logs(conn)
+        for table in metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, engine.dialect)}'))
+        metadata.create_all(bind=conn)
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        # Tabelas criadas agora já ganharam o FTS pelo after_create de resources
+        if not conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'resources_fts'")).first():
+            for statement in models.RESOURCE_FTS_DDL:
+                conn.execute(text(statement))
+        conn.execute(MARK_ROLLUPS_IF_EMPTY)
+        conn.execute(MARK_ROLLUP_VECTORS_IF_EMPTY)
+        backfilled = conn.execute(text('SELECT 1 FROM access_log_rollup_state')).first()
+    if not backfilled:
+        print('⚠️  Agregados de acesso sem backfill (heatmap lendo logs brutos): execute python -m app.rollups')
+
+
+if __name__ == '__main__':
+    upgrade_database()
+    print('✅ Esquema do banco atualizado')
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Contexto único de hash de senhas (bcrypt) e calibração do custo para o hardware.
+
+O custo do bcrypt dobra a cada round e limita quantos logins por segundo cada núcleo atende.
+Para escolher BCRYPT_ROUNDS na máquina de produção:
+
+    python -m app.hashing --target-ms 250
+
+Hashes gravados com outro custo são refeitos no próximo login bem-sucedido (needs_update).
+"""
+import os
+import sys
+import time
+import argparse
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', '250'))
+MIN_ROUNDS, MAX_ROUNDS = 10, 16
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Retorna (senha confere, novo hash se o atual usa outro custo ou esquema)"""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def measure(rounds: int, samples: int = 3) -> float:
+    """Menor tempo de verificação (ms) com o custo `rounds` neste host"""
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    hashed = context.hash('calibration-password')
+    best = float('inf')
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify('calibration-password', hashed)
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return best
+
+
+def calibrate(target_ms: float = BCRYPT_TARGET_MS, samples: int = 3):
+    """Maior custo cuja verificação fica dentro de target_ms (nunca abaixo de MIN_ROUNDS).
+
+    Mede o custo mínimo e extrapola (cada round dobra o tempo); o valor escolhido é medido de
+    novo para confirmar. Retorna (rounds, ms medidos).
+    """
+    base = measure(MIN_ROUNDS, samples)
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS and base * 2 ** (rounds + 1 - MIN_ROUNDS) <= target_ms:
+        rounds += 1
+    elapsed = measure(rounds, samples)
+    while rounds > MIN_ROUNDS and elapsed > target_ms:
+        rounds -= 1
+        elapsed = measure(rounds, samples)
+    return rounds, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibra o custo do bcrypt para uma latência alvo de verificação')
+    parser.add_argument('--target-ms', type=float, default=BCRYPT_TARGET_MS)
+    parser.add_argument('--samples', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rounds, elapsed = calibrate(args.target_ms, args.samples)
+    print(f'Verificação com {rounds} rounds: {elapsed:.0f}ms (alvo {args.target_ms:.0f}ms, '
+          f'~{1000 / elapsed:.1f} logins/s por núcleo); atual: {BCRYPT_ROUNDS}')
+    print(f'BCRYPT_ROUNDS={rounds}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
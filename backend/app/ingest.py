@@ -0,0 +1,181 @@
+import os
+import json
+import asyncio
+import threading
+from typing import Optional
+from pydantic import ValidationError
+from fastapi import WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+from . import crud, schemas, auth, cache_bus, sharding, occupancy
+from .database import ReadSessionLocal
+
+# Lote gravado quando atinge INGEST_BATCH_SIZE eventos ou INGEST_FLUSH_MS após o primeiro evento pendente
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_FLUSH_MS = int(os.getenv('INGEST_FLUSH_MS', '50'))
+# Prazo para a mensagem {"type": "auth", "token": ...} de quem não manda o token no handshake
+INGEST_AUTH_TIMEOUT_SECONDS = float(os.getenv('INGEST_AUTH_TIMEOUT_SECONDS', '10'))
+# Subprotocolo que carrega o token no handshake: Sec-WebSocket-Protocol: bearer, <token>
+BEARER_SUBPROTOCOL = 'bearer'
+
+# Um lote por vez por controlador neste processo (cursor lido e avançado na mesma transação)
+_controller_locks = {}
+_controller_locks_guard = threading.Lock()
+
+
+def _controller_lock(controller_id: str):
+    with _controller_locks_guard:
+        return _controller_locks.setdefault(controller_id, threading.Lock())
+
+
+def authorize(token: str, controller_id: Optional[str] = None):
+    """Retorna o controlador que o dono do token pode usar, ou None.
+
+    O cursor do controlador decide quais eventos são descartados como replay, então o id precisa
+    pertencer ao usuário: registrado em ingest_controllers para ele, ou (sem registro) o próprio
+    username — o padrão quando controller_id não é informado.
+    """
+    db = ReadSessionLocal()
+    try:
+        user = auth.get_user_from_token(db, token)
+        if not user or not user.is_active:
+            return None
+        controller_id = controller_id or user.username
+        registered = crud.get_ingest_controller(db, controller_id)
+        if registered:
+            return controller_id if registered.owner_id == user.id else None
+        return controller_id if controller_id == user.username else None
+    finally:
+        db.close()
+
+
+def _handshake_token(websocket: WebSocket):
+    """(token, subprotocolo) do handshake: cabeçalho Authorization ou subprotocolo "bearer, <token>".
+
+    O token nunca vem da URL, que acaba em logs de acesso de proxies e servidores.
+    """
+    scheme, _, token = websocket.headers.get('authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return token.strip(), None
+    protocols = [p.strip() for p in websocket.headers.get('sec-websocket-protocol', '').split(',')]
+    if BEARER_SUBPROTOCOL in protocols[:-1]:
+        return protocols[protocols.index(BEARER_SUBPROTOCOL) + 1], BEARER_SUBPROTOCOL
+    return None, None
+
+
+async def _first_message_token(websocket: WebSocket):
+    try:
+        message = await asyncio.wait_for(websocket.receive_json(), INGEST_AUTH_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        return None
+    if isinstance(message, dict) and message.get('type') == 'auth' and isinstance(message.get('token'), str):
+        return message['token']
+    return None
+
+
+async def authenticate(websocket: WebSocket, controller_id: Optional[str] = None):
+    """Aceita a conexão e retorna o controlador autorizado, ou fecha com 1008 e retorna None.
+
+    Com o token no handshake, a conexão só é aceita depois de validá-lo; sem ele, é aceita e a
+    primeira mensagem precisa ser {"type": "auth", "token": ...} dentro do prazo.
+    """
+    token, subprotocol = _handshake_token(websocket)
+    if token is None:
+        await websocket.accept()
+        token = await _first_message_token(websocket)
+        controller = token and await run_in_threadpool(authorize, token, controller_id)
+    else:
+        controller = await run_in_threadpool(authorize, token, controller_id)
+        if controller:
+            await websocket.accept(subprotocol=subprotocol)
+    if not controller:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return None
+    return controller
+
+
+def read_cursor(controller_id: str):
+    # Cada shard guarda o próprio cursor; o controlador retoma do menor
+    return min(sharding.scatter(lambda db: crud.get_ingest_cursor(db, controller_id)))
+
+
+def flush(controller_id: str, events, max_seq: int):
+    """Grava o lote em cada shard (eventos roteados pela área) e avança o cursor de todos até max_seq.
+
+    Cada shard descarta os eventos com seq <= seu cursor, então um lote que falhou no meio é
+    reenviado inteiro sem duplicar o que os outros shards já gravaram.
+    """
+    by_shard = {}
+    for event in events:
+        by_shard.setdefault(sharding.shard_for_area(event.area_id).number, []).append(event)
+    with _controller_lock(controller_id):
+        results = sharding.each(
+            lambda shard, db: crud.ingest_access_logs(db, controller_id, by_shard.get(shard.number, []), max_seq),
+            write=True,
+        )
+    if any(inserted for _, inserted in results):
+        cache_bus.bus.publish('access_logs')
+        occupancy.tracker.wake()
+    return min(acked for acked, _ in results)
+
+
+def _parse(message: str):
+    payload = json.loads(message)
+    if isinstance(payload, dict) and 'events' in payload:
+        payload = payload['events']
+    return payload if isinstance(payload, list) else [payload]
+
+
+async def stream_access_logs(websocket: WebSocket, controller_id: str):
+    """Recebe eventos {"seq", "user_id", "area_id", ...} (um por mensagem ou {"events": [...]}),
+    grava em lotes e responde com acks cumulativos {"type": "ack", "seq": N}.
+
+    Ao conectar, o servidor envia {"type": "hello", "last_seq": N}: o controlador reenvia a partir
+    de N + 1, e eventos com seq já confirmado são descartados sem duplicar logs.
+    """
+    loop = asyncio.get_running_loop()
+    acked = await run_in_threadpool(read_cursor, controller_id)
+    await websocket.send_json({"type": "hello", "last_seq": acked})
+
+    pending, max_seq, deadline = [], acked, None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                message = await asyncio.wait_for(websocket.receive_text(), timeout)
+            except asyncio.TimeoutError:
+                message = None
+
+            if message is not None:
+                try:
+                    raw_events = _parse(message)
+                except ValueError:
+                    await websocket.send_json({"type": "error", "detail": "Invalid JSON"})
+                    continue
+                for raw in raw_events:
+                    seq = raw.get('seq') if isinstance(raw, dict) else None
+                    try:
+                        event = schemas.AccessLogEvent(**raw)
+                    except (TypeError, ValidationError) as exc:
+                        if isinstance(exc, ValidationError):
+                            detail = [{"loc": list(err["loc"]), "msg": err["msg"]} for err in exc.errors()]
+                        else:
+                            detail = "Event must be a JSON object"
+                        await websocket.send_json({"type": "error", "seq": seq, "detail": detail})
+                        # Evento inválido não melhora com reenvio: entra no ack para não travar o stream
+                        if isinstance(seq, int):
+                            max_seq = max(max_seq, seq)
+                        continue
+                    if event.seq > acked:
+                        pending.append(event)
+                    max_seq = max(max_seq, event.seq)
+                if deadline is None and max_seq > acked:
+                    deadline = loop.time() + INGEST_FLUSH_MS / 1000
+
+            if max_seq > acked and (len(pending) >= INGEST_BATCH_SIZE or message is None):
+                acked = await run_in_threadpool(flush, controller_id, pending, max_seq)
+                pending, deadline = [], None
+                await websocket.send_json({"type": "ack", "seq": acked})
+    finally:
+        # Desconexão: grava o que já chegou; o ack perdido é resolvido pelo replay idempotente
+        if max_seq > acked:
+            await run_in_threadpool(flush, controller_id, pending, max_seq)
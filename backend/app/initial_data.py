@@ -1,10 +1,16 @@
 import os
 from .database import SessionLocal, recreate_database
-from . import models, crud, schemas
+from . import models, crud, schemas, columnar, sharding, occupancy, cache_bus
 
 def create_initial_data():
-    # Recria o banco de dados
+    # Recria o banco de dados e os shards de logs (e descarta os segmentos colunares e o checkpoint de ocupação)
     recreate_database()
+    sharding.recreate()
+    for shard in sharding.shards():
+        segments = columnar.store_for(shard.engine)
+        if segments:
+            segments.reset()
+    occupancy.tracker.reset()
     
     db = SessionLocal()
     try:
@@ -85,8 +91,9 @@ def create_initial_data():
             
         # Criar alguns logs de acesso de exemplo
         from datetime import datetime, timedelta
-        access_logs_count = db.query(models.AccessLog).count()
-        if access_logs_count == 0:
+        # Logs ficam nos shards: procura em todos, não só no banco principal
+        has_access_logs = any(sharding.scatter(lambda log_db: log_db.query(models.AccessLog.id).first() is not None, db))
+        if not has_access_logs:
             # Buscar usuário admin e primeira área
             admin_user = crud.get_user_by_username(db, 'admin')
             first_area = db.query(models.RestrictedArea).first()
@@ -101,8 +108,11 @@ def create_initial_data():
                     )
                 ]
                 
+                # Cada log vai para o shard da sua área, como em POST /access-logs/
                 for log in sample_logs:
-                    crud.create_access_log(db, log)
+                    with sharding.session(db, sharding.shard_for_area(log.area_id)) as log_db:
+                        crud.create_access_log(log_db, log)
+                cache_bus.bus.publish('access_logs')
                 
                 print('✅ Logs de acesso de exemplo criados')
         
@@ -1,13 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Request, Response, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from . import models, schemas, crud, auth
+from typing import Optional, Literal, Union
+from functools import lru_cache
+from pydantic import BaseModel, TypeAdapter
+from . import models, schemas, crud, auth, admission, analytics, cache_bus, ingest, bulk, singleflight, hashing, sharding, occupancy
+from . import database
 from .database import engine, Base
 
 # Base.metadata.create_all(bind=engine)
-app = FastAPI(title="Wayne Industries Security API")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Esquema de bancos criados por versões anteriores (colunas, tabelas e índices novos)
+    await run_in_threadpool(database.upgrade_database)
+    # Ocupação das áreas: checkpoint + final do log em segundo plano, sem segurar a subida;
+    # checkpoint final ao encerrar
+    occupancy.tracker.start()
+    yield
+    await run_in_threadpool(occupancy.tracker.stop)
+
+
+app = FastAPI(title="Wayne Industries Security API", lifespan=lifespan)
+
+# Controle de admissão para o login (bcrypt) e as agregações, antes da autenticação e do pool do banco
+app.add_middleware(admission.AdmissionMiddleware)
 
 # Configuração CORS
 app.add_middleware(
@@ -16,9 +40,75 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[auth.READ_YOUR_WRITES_HEADER],
 )
 
 
+BulkFormat = Literal['csv', 'ndjson']
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _export_response(model, fmt: str, filename: str):
+    return StreamingResponse(
+        bulk.export_rows(model, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+# Com include_members a resposta embute authorized_users; sem ele o relacionamento nem é carregado
+AreaResponse = Union[schemas.RestrictedAreaWithMembers, schemas.RestrictedAreaOut]
+
+
+def _area_out(area, include_members: bool):
+    schema = schemas.RestrictedAreaWithMembers if include_members else schemas.RestrictedAreaOut
+    return schema.model_validate(area)
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema):
+    return TypeAdapter(schema)
+
+
+async def _shared(request: Request, db: Session, key, compute, schema, cache_key=None):
+    """Single-flight sem segurar conexão nem thread: a sessão da requisição é liberada antes.
+
+    Só o líder volta a usar a sessão (e o pool) e serializa a resposta, no threadpool; os demais
+    esperam no loop e devolvem os mesmos bytes. Com cache_key, os bytes vão para o cache das
+    agregações (analytics.cached). compute pode devolver o schema já montado, sem revalidação.
+    Quem acabou de escrever (auth.wrote_recently) calcula sozinho, sem voo compartilhado nem cache,
+    para ver a própria escrita.
+    """
+    await run_in_threadpool(db.close)
+    adapter = _adapter(schema)
+
+    def serialize():
+        value = compute()
+        if not isinstance(value, BaseModel):
+            value = adapter.validate_python(value, from_attributes=True)
+        return adapter.dump_json(value)
+
+    if auth.wrote_recently(request):
+        body = await run_in_threadpool(serialize)
+    else:
+        body = await singleflight.group.do_async(key, (lambda: analytics.cached(cache_key, serialize)) if cache_key else serialize)
+    return Response(content=body, media_type='application/json')
+
+
+def _etag(version: int):
+    return f'"{version}"'
+
+
+def _expected_version(if_match: Optional[str]):
+    """Converte o cabeçalho If-Match (ETag da versão) na versão esperada; None aceita qualquer versão"""
+    if if_match is None or if_match.strip() == '*':
+        return None
+    try:
+        return int(if_match.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid If-Match header')
+
+
 # ==============================================================================
 # ENDPOINTS DE AUTENTICAÇÃO
 # ==============================================================================
@@ -26,7 +116,8 @@ app.add_middleware(
 @app.post('/token', response_model=schemas.Token)
 def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(auth.get_db)
+    db: Session = Depends(auth.get_db),
+    _: None = Depends(admission.limit_login)
 ):
     """Endpoint para login e obtenção de tokens de acesso"""
     user = auth.authenticate_user(db, form_data.username, form_data.password)
@@ -105,14 +196,16 @@ def create_user(
     db_user = crud.get_user_by_username(db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail='Username already registered')
-    return crud.create_user(db, user)
+    db_user = crud.create_user(db, user)
+    cache_bus.bus.publish('users')
+    return db_user
 
 
 @app.get('/users/', response_model=list[schemas.UserOut])
 def list_users(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(auth.get_db), 
+    db: Session = Depends(auth.get_read_db), 
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Lista todos os usuários (apenas para security_admin)"""
@@ -120,7 +213,7 @@ def list_users(
 
 
 @app.get('/users/me', response_model=schemas.UserWithAreas)
-async def read_users_me(
+def read_users_me(
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Retorna informações do usuário atual"""
@@ -130,13 +223,15 @@ async def read_users_me(
 @app.get('/users/{user_id}', response_model=schemas.UserOut)
 def get_user(
     user_id: int,
-    db: Session = Depends(auth.get_db),
+    response: Response,
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Obtém um usuário específico por ID (apenas para security_admin)"""
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail='User not found')
+    response.headers['ETag'] = _etag(user.version)
     return user
 
 
@@ -169,17 +264,44 @@ def update_user(
     db_user.email = user.email
     db_user.full_name = user.full_name
     db_user.role = user.role
+    db_user.version = models.User.version + 1
     
     # Se uma nova senha foi fornecida, atualizar
     if user.password:
-        hashed = auth.pwd_context.hash(user.password)
+        hashed = hashing.hash_password(user.password)
         db_user.hashed_password = hashed
     
     db.commit()
     db.refresh(db_user)
+    cache_bus.bus.publish('users', 'restricted_areas')
     return db_user
 
 
+@app.patch('/users/{user_id}', response_model=schemas.UserOut)
+def patch_user(
+    user_id: int,
+    user: schemas.UserPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Atualiza parcialmente um usuário; com If-Match, falha (412) se ele mudou (apenas para security_admin)"""
+    try:
+        updated = crud.patch_user(db, user_id, user, _expected_version(if_match))
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail='Username or email already registered')
+    if not updated:
+        if not db.query(models.User.id).filter(models.User.id == user_id).first():
+            raise HTTPException(status_code=404, detail='User not found')
+        raise HTTPException(status_code=412, detail='User was modified by another request')
+    # Mesmos tópicos do PUT: áreas (authorized_users) e logs embutem o usuário
+    cache_bus.bus.publish('users', 'restricted_areas')
+    response.headers['ETag'] = _etag(updated['version'])
+    return updated
+
+
 @app.delete('/users/{user_id}')
 def delete_user(
     user_id: int, 
@@ -195,8 +317,11 @@ def delete_user(
     if db_user.id == current_user.id:
         raise HTTPException(status_code=400, detail='Cannot delete your own account')
     
+    # Controladores do usuário não podem passar para quem herdar o id
+    db.query(models.IngestController).filter(models.IngestController.owner_id == user_id).delete()
     db.delete(db_user)
     db.commit()
+    cache_bus.bus.publish('users', 'restricted_areas')
     return {"ok": True}
 
 
@@ -211,30 +336,65 @@ def create_resource(
     current_user: models.User = Depends(auth.require_role('manager'))
 ):
     """Cria um novo recurso (apenas para manager)"""
-    return crud.create_resource(db, resource)
+    db_res = crud.create_resource(db, resource)
+    cache_bus.bus.publish('resources')
+    return db_res
 
 
 @app.get('/resources/', response_model=list[schemas.ResourceOut])
 def list_resources(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(auth.get_db), 
+    resource_type: Optional[str] = Query(None, alias='type'),
+    status: Optional[str] = None,
+    location: Optional[str] = None,
+    q: Optional[str] = None,
+    db: Session = Depends(auth.get_read_db), 
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Lista todos os recursos"""
-    return crud.list_resources(db, skip=skip, limit=limit)
+    """Lista recursos com filtros por tipo, status e localização; `q` faz busca full-text por relevância"""
+    filters = dict(resource_type=resource_type, status=status, location=location)
+    if q:
+        return crud.search_resources(db, q, skip=skip, limit=limit, **filters)
+    return crud.list_resources(db, skip=skip, limit=limit, **filters)
+
+
+@app.post('/resources/import', response_model=schemas.BulkImportReport)
+def import_resources(
+    file: UploadFile = File(...),
+    format: Optional[BulkFormat] = None,
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('manager'))
+):
+    """Importa recursos de CSV/NDJSON em lotes, com relatório de erros por linha (apenas para manager)"""
+    records = bulk.iter_records(file.file, bulk.detect_format(file.filename, format))
+    report = bulk.import_records(db, records, schemas.ResourceCreate, models.Resource)
+    if report["inserted"]:
+        cache_bus.bus.publish('resources')
+    return report
+
+
+@app.get('/resources/export')
+def export_resources(
+    format: BulkFormat = 'csv',
+    current_user: models.User = Depends(auth.require_role('manager'))
+):
+    """Exporta todos os recursos em CSV/NDJSON via streaming (apenas para manager)"""
+    return _export_response(models.Resource, format, 'resources')
 
 
 @app.get('/resources/{resource_id}', response_model=schemas.ResourceOut)
 def get_resource(
     resource_id: int, 
-    db: Session = Depends(auth.get_db), 
+    response: Response,
+    db: Session = Depends(auth.get_read_db), 
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Obtém um recurso específico por ID"""
     res = crud.get_resource(db, resource_id)
     if not res:
         raise HTTPException(status_code=404, detail='Resource not found')
+    response.headers['ETag'] = _etag(res.version)
     return res
 
 
@@ -249,6 +409,27 @@ def update_resource(
     updated = crud.update_resource(db, resource_id, resource)
     if not updated:
         raise HTTPException(status_code=404, detail='Resource not found')
+    cache_bus.bus.publish('resources')
+    return updated
+
+
+@app.patch('/resources/{resource_id}', response_model=schemas.ResourceOut)
+def patch_resource(
+    resource_id: int,
+    resource: schemas.ResourcePatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('manager'))
+):
+    """Atualiza parcialmente um recurso; com If-Match, falha (412) se ele mudou (apenas para manager)"""
+    updated = crud.patch_resource(db, resource_id, resource, _expected_version(if_match))
+    if not updated:
+        if not crud.get_resource(db, resource_id):
+            raise HTTPException(status_code=404, detail='Resource not found')
+        raise HTTPException(status_code=412, detail='Resource was modified by another request')
+    cache_bus.bus.publish('resources')
+    response.headers['ETag'] = _etag(updated['version'])
     return updated
 
 
@@ -262,6 +443,7 @@ def delete_resource(
     deleted = crud.delete_resource(db, resource_id)
     if not deleted:
         raise HTTPException(status_code=404, detail='Resource not found')
+    cache_bus.bus.publish('resources')
     return {"ok": True}
 
 
@@ -276,31 +458,104 @@ def create_restricted_area(
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Cria uma nova área restrita (apenas para security_admin)"""
-    return crud.create_restricted_area(db, area)
+    db_area = crud.create_restricted_area(db, area)
+    cache_bus.bus.publish('restricted_areas')
+    return db_area
 
 
-@app.get('/restricted-areas/', response_model=list[schemas.RestrictedAreaOut])
+@app.get('/restricted-areas/', response_model=list[AreaResponse])
 def list_restricted_areas(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(auth.get_db),
+    include_members: bool = False,
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    """Lista todas as áreas restritas"""
-    return crud.get_restricted_areas(db, skip=skip, limit=limit)
+    """Lista todas as áreas restritas com a contagem de membros (a lista completa só com include_members=true)"""
+    areas = crud.get_restricted_areas(db, skip=skip, limit=limit, include_members=include_members)
+    return [_area_out(area, include_members) for area in areas]
 
 
-@app.get('/restricted-areas/{area_id}', response_model=schemas.RestrictedAreaOut)
+@app.post('/restricted-areas/import', response_model=schemas.BulkImportReport)
+def import_restricted_areas(
+    file: UploadFile = File(...),
+    format: Optional[BulkFormat] = None,
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Importa áreas restritas de CSV/NDJSON em lotes, com relatório de erros por linha (apenas para security_admin)"""
+    records = bulk.iter_records(file.file, bulk.detect_format(file.filename, format))
+    report = bulk.import_records(db, records, schemas.RestrictedAreaCreate, models.RestrictedArea)
+    if report["inserted"]:
+        cache_bus.bus.publish('restricted_areas')
+    return report
+
+
+@app.get('/restricted-areas/export')
+def export_restricted_areas(
+    format: BulkFormat = 'csv',
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Exporta todas as áreas restritas em CSV/NDJSON via streaming (apenas para security_admin)"""
+    return _export_response(models.RestrictedArea, format, 'restricted_areas')
+
+
+def _occupancy(read):
+    # Estado ainda carregando na subida: o cliente tenta de novo em instantes
+    try:
+        return read()
+    except occupancy.OccupancyNotReady as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
+
+@app.get('/restricted-areas/occupancy', response_model=schemas.OccupancySummary)
+def get_occupancy_summary(
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Ocupação atual de todas as áreas, mantida em memória (apenas para security_admin)"""
+    return _occupancy(occupancy.tracker.summary)
+
+
+@app.get('/restricted-areas/{area_id}', response_model=AreaResponse)
 def get_restricted_area(
     area_id: int,
-    db: Session = Depends(auth.get_db),
+    include_members: bool = False,
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Obtém uma área restrita específica por ID"""
     area = crud.get_restricted_area(db, area_id)
     if not area:
         raise HTTPException(status_code=404, detail='Restricted area not found')
-    return area
+    crud.attach_member_counts(db, [area])
+    return _area_out(area, include_members)
+
+
+@app.get('/restricted-areas/{area_id}/members', response_model=schemas.AreaMembers)
+def list_area_members(
+    area_id: int,
+    skip: int = 0,
+    limit: int = Query(100, le=500),
+    q: Optional[str] = None,
+    db: Session = Depends(auth.get_read_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Lista os usuários autorizados na área, paginado e com busca (apenas para security_admin)"""
+    if not crud.get_restricted_area(db, area_id):
+        raise HTTPException(status_code=404, detail='Restricted area not found')
+    return crud.get_area_members(db, area_id, skip=skip, limit=limit, search=q)
+
+
+@app.get('/restricted-areas/{area_id}/occupancy', response_model=schemas.AreaOccupancy)
+def get_area_occupancy(
+    area_id: int,
+    db: Session = Depends(auth.get_read_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Quem está na área agora e estatísticas de permanência (apenas para security_admin)"""
+    if not crud.get_restricted_area(db, area_id):
+        raise HTTPException(status_code=404, detail='Restricted area not found')
+    return _occupancy(lambda: occupancy.tracker.area(area_id))
 
 
 @app.put('/restricted-areas/{area_id}', response_model=schemas.RestrictedAreaOut)
@@ -321,6 +576,8 @@ def update_restricted_area(
     
     db.commit()
     db.refresh(db_area)
+    cache_bus.bus.publish('restricted_areas')
+    crud.attach_member_counts(db, [db_area])
     return db_area
 
 
@@ -337,6 +594,7 @@ def delete_restricted_area(
     
     db.delete(db_area)
     db.commit()
+    cache_bus.bus.publish('restricted_areas')
     return {"ok": True}
 
 
@@ -351,6 +609,7 @@ def grant_area_access(
     area = crud.grant_area_access(db, user_id, area_id)
     if not area:
         raise HTTPException(status_code=404, detail='Area or user not found')
+    cache_bus.bus.publish('restricted_areas', 'users')
     return {"ok": True, "message": "Access granted"}
 
 
@@ -365,6 +624,7 @@ def revoke_area_access(
     area = crud.revoke_area_access(db, user_id, area_id)
     if not area:
         raise HTTPException(status_code=404, detail='Area or user not found')
+    cache_bus.bus.publish('restricted_areas', 'users')
     return {"ok": True, "message": "Access revoked"}
 
 
@@ -379,31 +639,102 @@ def create_access_log(
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Cria um novo log de acesso"""
-    return crud.create_access_log(db, access_log)
+    # Gravado no shard do site da área (no banco principal quando não há shards)
+    with sharding.session(db, sharding.shard_for_area(access_log.area_id)) as log_db:
+        db_log = crud.create_access_log(log_db, access_log)
+    cache_bus.bus.publish('access_logs')
+    occupancy.tracker.record(db_log)
+    return sharding.logs_out(db, [db_log])[0]
+
+
+@app.websocket('/ws/access-logs')
+async def access_log_stream(
+    websocket: WebSocket,
+    controller_id: Optional[str] = None
+):
+    """Canal persistente de ingestão de eventos para controladores de porta.
+
+    Token JWT no cabeçalho Authorization, no subprotocolo ("bearer", <token>) ou na primeira
+    mensagem {"type": "auth", "token": ...}; nunca na URL.
+    """
+    # controller_id precisa estar registrado para o usuário do token (sem ele, vale o username)
+    controller = await ingest.authenticate(websocket, controller_id)
+    if not controller:
+        return
+    try:
+        await ingest.stream_access_logs(websocket, controller)
+    except WebSocketDisconnect:
+        pass
+
+
+@app.post('/ingest/controllers', response_model=schemas.IngestControllerOut)
+def register_ingest_controller(
+    controller: schemas.IngestControllerCreate,
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Registra um controlador de porta para um usuário do canal de ingestão (apenas para security_admin)"""
+    owner = db.query(models.User).filter(models.User.id == controller.owner_id).first()
+    if not owner:
+        raise HTTPException(status_code=404, detail='User not found')
+    if crud.get_ingest_controller(db, controller.controller_id):
+        raise HTTPException(status_code=400, detail='Controller already registered')
+    # Ids iguais ao username de outro usuário seriam usados por ele como controlador padrão
+    username_owner = crud.get_user_by_username(db, controller.controller_id)
+    if username_owner and username_owner.id != owner.id:
+        raise HTTPException(status_code=400, detail='Controller id matches another username')
+    return crud.create_ingest_controller(db, controller)
+
+
+@app.get('/ingest/controllers', response_model=list[schemas.IngestControllerOut])
+def list_ingest_controllers(
+    db: Session = Depends(auth.get_read_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Lista os controladores de porta registrados (apenas para security_admin)"""
+    return crud.list_ingest_controllers(db)
+
+
+@app.delete('/ingest/controllers/{controller_id}')
+def delete_ingest_controller(
+    controller_id: str,
+    db: Session = Depends(auth.get_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Remove o registro de um controlador de porta (apenas para security_admin)"""
+    if not crud.delete_ingest_controller(db, controller_id):
+        raise HTTPException(status_code=404, detail='Controller not found')
+    return {"ok": True}
 
 
 @app.get('/access-logs/', response_model=list[schemas.AccessLogOut])
-def list_access_logs(
+async def list_access_logs(
+    request: Request,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(auth.get_db),
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Lista todos os logs de acesso (apenas para security_admin)"""
-    return crud.get_access_logs(db, skip=skip, limit=limit)
+    # Leituras idênticas simultâneas (ex.: painéis atualizando juntos) compartilham uma consulta
+    key = ('/access-logs/', skip, limit, current_user.role)
+    return await _shared(request, db, key, lambda: sharding.logs_out(
+        db, sharding.recent_logs(db, lambda log_db, skip, limit: crud.get_access_logs(log_db, skip=skip, limit=limit), skip, limit)
+    ), list[schemas.AccessLogOut])
 
 
 @app.get('/access-logs/{log_id}', response_model=schemas.AccessLogOut)
 def get_access_log(
     log_id: int,
-    db: Session = Depends(auth.get_db),
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Obtém um log de acesso específico por ID (apenas para security_admin)"""
-    log = db.query(models.AccessLog).filter(models.AccessLog.id == log_id).first()
+    with sharding.session(db, sharding.shard_for_log(log_id), write=False) as log_db:
+        log = crud.get_access_log(log_db, log_id)
     if not log:
         raise HTTPException(status_code=404, detail='Access log not found')
-    return log
+    return sharding.logs_out(db, [log])[0]
 
 
 @app.delete('/access-logs/{log_id}')
@@ -413,12 +744,11 @@ def delete_access_log(
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Exclui um log de acesso (apenas para security_admin)"""
-    log = db.query(models.AccessLog).filter(models.AccessLog.id == log_id).first()
+    with sharding.session(db, sharding.shard_for_log(log_id)) as log_db:
+        log = crud.delete_access_log(log_db, log_id)
     if not log:
         raise HTTPException(status_code=404, detail='Access log not found')
-    
-    db.delete(log)
-    db.commit()
+    cache_bus.bus.publish('access_logs')
     return {"ok": True}
 
 
@@ -427,7 +757,7 @@ def get_user_access_logs(
     user_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(auth.get_db),
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.require_role('security_admin'))
 ):
     """Lista logs de acesso de um usuário específico (apenas para security_admin)"""
@@ -435,14 +765,10 @@ def get_user_access_logs(
     if not user:
         raise HTTPException(status_code=404, detail='User not found')
     
-    logs = db.query(models.AccessLog)\
-        .filter(models.AccessLog.user_id == user_id)\
-        .order_by(models.AccessLog.access_time.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    
-    return logs
+    logs = sharding.recent_logs(
+        db, lambda log_db, skip, limit: crud.get_user_access_logs(log_db, user_id, skip=skip, limit=limit), skip, limit
+    )
+    return sharding.logs_out(db, logs)
 
 
 # ==============================================================================
@@ -450,12 +776,68 @@ def get_user_access_logs(
 # ==============================================================================
 
 @app.get('/dashboard/stats', response_model=schemas.DashboardStats)
-def get_dashboard_stats(
-    db: Session = Depends(auth.get_db),
+async def get_dashboard_stats(
+    request: Request,
+    db: Session = Depends(auth.get_read_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     """Retorna estatísticas para o dashboard"""
-    return crud.get_dashboard_stats(db)
+    key = ('/dashboard/stats', current_user.role)
+    return await _shared(request, db, key, lambda: crud.get_dashboard_stats(db, sharding.scatter(crud.get_access_log_stats, db)), schemas.DashboardStats)
+
+
+# ==============================================================================
+# ENDPOINTS DE ANALYTICS
+# ==============================================================================
+
+@app.get('/analytics/anomalies', response_model=schemas.AnomalyReport)
+async def get_access_anomalies(
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket_minutes: int = Query(60, ge=1, le=1440),
+    z_threshold: float = Query(3.0, gt=0),
+    db: Session = Depends(auth.get_read_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Detecta anomalias nos logs de acesso da janela (apenas para security_admin)"""
+    start, end = analytics.resolve_window(start, end, bucket_minutes)
+    if start >= end:
+        raise HTTPException(status_code=400, detail='start must be before end')
+    key = ('/analytics/anomalies', start, end, bucket_minutes, z_threshold)
+    compute = lambda: analytics.detect_anomalies(db, start, end, bucket_minutes, z_threshold)
+    return await _shared(request, db, key + (current_user.role,), compute, schemas.AnomalyReport, cache_key=key)
+
+
+@app.get('/analytics/heatmap', response_model=schemas.AccessHeatmap)
+async def get_access_heatmap(
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Literal['hour', 'day', 'week'] = 'hour',
+    db: Session = Depends(auth.get_read_db),
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Matriz de acessos concedidos/negados por área e intervalo no período (apenas para security_admin)"""
+    bucket_minutes = analytics.HEATMAP_BUCKETS[bucket][0] // 60
+    start, end = analytics.resolve_window(start, end, bucket_minutes, default_days=1 if bucket == 'hour' else 30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail='start must be before end')
+    key = ('/analytics/heatmap', start, end, bucket)
+    # Milhões de células já tipadas pelo NumPy: monta o schema sem revalidar
+    compute = lambda: schemas.AccessHeatmap.model_construct(**analytics.access_heatmap(db, start, end, bucket))
+    try:
+        return await _shared(request, db, key + (current_user.role,), compute, schemas.AccessHeatmap, cache_key=key)
+    except analytics.HeatmapTooLarge as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.get('/metrics/singleflight')
+def get_singleflight_metrics(
+    current_user: models.User = Depends(auth.require_role('security_admin'))
+):
+    """Métricas de coalescência de requisições por rota (apenas para security_admin)"""
+    return singleflight.group.metrics()
 
 
 # ==============================================================================
@@ -463,6 +845,6 @@ def get_dashboard_stats(
 # ==============================================================================
 
 @app.get("/health")
-def health_check():
-    """Endpoint de verificação de saúde da API"""
+async def health_check():
+    """Endpoint de verificação de saúde da API (no loop de eventos: não espera pelo threadpool)"""
     return {"status": "healthy", "message": "Wayne Industries API is running"}
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, LargeBinary, ForeignKey, Table, Index, DDL, event
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -6,7 +6,11 @@ import datetime
 # Tabela de associação para áreas de acesso
 user_accessible_areas = Table('user_accessible_areas', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('area_id', Integer, ForeignKey('restricted_areas.id'))
+    Column('area_id', Integer, ForeignKey('restricted_areas.id')),
+    # Contagem e paginação de membros por área sem varrer a tabela inteira
+    Index('ix_user_accessible_areas_area_user', 'area_id', 'user_id'),
+    # Áreas de um usuário (user.accessible_areas, concessão/revogação de acesso)
+    Index('ix_user_accessible_areas_user_area', 'user_id', 'area_id')
 )
 
 class User(Base):
@@ -19,6 +23,7 @@ class User(Base):
     role = Column(String, default="employee")
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    version = Column(Integer, default=1, nullable=False)  # controle otimista de concorrência (ETag)
     refresh_tokens = relationship('RefreshToken', back_populates='user')
     accessible_areas = relationship('RestrictedArea', secondary=user_accessible_areas, back_populates='authorized_users')
     access_logs = relationship('AccessLog', back_populates='user')
@@ -29,10 +34,38 @@ class Resource(Base):
     name = Column(String, index=True, nullable=False)
     type = Column(String, index=True)
     details = Column(Text, nullable=True)
-    status = Column(String, default="available")  # available, in_use, maintenance
-    location = Column(String, nullable=True)
+    status = Column(String, default="available", index=True)  # available, in_use, maintenance
+    location = Column(String, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    version = Column(Integer, default=1, nullable=False)  # controle otimista de concorrência (ETag)
+
+# Índice full-text (SQLite FTS5) de recursos, mantido em sincronia por triggers
+RESOURCE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS resources_fts USING fts5(
+        name, details, location,
+        content='resources', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS resources_fts_ai AFTER INSERT ON resources BEGIN
+        INSERT INTO resources_fts(rowid, name, details, location)
+        VALUES (new.id, new.name, new.details, new.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resources_fts_ad AFTER DELETE ON resources BEGIN
+        INSERT INTO resources_fts(resources_fts, rowid, name, details, location)
+        VALUES ('delete', old.id, old.name, old.details, old.location);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS resources_fts_au AFTER UPDATE OF name, details, location ON resources BEGIN
+        INSERT INTO resources_fts(resources_fts, rowid, name, details, location)
+        VALUES ('delete', old.id, old.name, old.details, old.location);
+        INSERT INTO resources_fts(rowid, name, details, location)
+        VALUES (new.id, new.name, new.details, new.location);
+    END""",
+    "INSERT INTO resources_fts(resources_fts) VALUES ('rebuild')",
+]
+for statement in RESOURCE_FTS_DDL:
+    event.listen(Resource.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Resource.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS resources_fts').execute_if(dialect='sqlite'))
 
 class RefreshToken(Base):
     __tablename__ = 'refresh_tokens'
@@ -59,8 +92,65 @@ class AccessLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     area_id = Column(Integer, ForeignKey('restricted_areas.id'))
-    access_time = Column(DateTime, default=datetime.datetime.utcnow)
+    access_time = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     access_type = Column(String, default="entry")  # entry, exit
-    status = Column(String, default="granted")  # granted, denied
+    status = Column(String, default="granted", index=True)  # granted, denied
     user = relationship('User', back_populates='access_logs')
-    area = relationship('RestrictedArea', back_populates='access_logs')
\ No newline at end of file
+    area = relationship('RestrictedArea', back_populates='access_logs')
+
+    # Logs de um usuário em ordem cronológica (/access-logs/user/{id}); AUTOINCREMENT impede
+    # reaproveitar ids excluídos, que o armazenamento colunar usa como marca d'água
+    __table_args__ = (
+        Index('ix_access_logs_user_time', 'user_id', 'access_time'),
+        {'sqlite_autoincrement': True},
+    )
+
+class AccessLogRollup(Base):
+    """Contagens pré-agregadas de acessos por área e intervalo (hora ou dia), mantidas na escrita dos logs"""
+    __tablename__ = "access_log_rollups"
+    granularity = Column(String, primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    area_id = Column(Integer, ForeignKey('restricted_areas.id'), primary_key=True)
+    granted = Column(Integer, default=0, nullable=False)
+    denied = Column(Integer, default=0, nullable=False)
+
+class AccessLogRollupVector(Base):
+    """Agregados de um intervalo empacotados em vetores int32 (áreas, concedidos, negados) para o heatmap.
+
+    Escritas que tocam o intervalo incrementam version e zeram os vetores; a leitura seguinte os
+    remonta a partir de access_log_rollups e grava de volta se a versão não mudou nesse meio tempo.
+    """
+    __tablename__ = "access_log_rollup_vectors"
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    version = Column(Integer, default=1, nullable=False)
+    area_ids = Column(LargeBinary)
+    granted = Column(LargeBinary)
+    denied = Column(LargeBinary)
+
+class AccessLogRollupState(Base):
+    """Linha única presente quando access_log_rollups cobre todo o histórico de access_logs do banco.
+
+    Bancos criados vazios já nascem completos; bancos que tinham logs antes dos agregados só
+    depois do backfill (python -m app.rollups). Até lá o heatmap lê os logs brutos.
+    """
+    __tablename__ = "access_log_rollup_state"
+    id = Column(Integer, primary_key=True)
+    backfilled_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+class IngestController(Base):
+    """Controlador de porta registrado: só o usuário dono pode usar o canal de ingestão com este id.
+
+    Ids não registrados só valem para o próprio username do usuário conectado (padrão do canal).
+    """
+    __tablename__ = "ingest_controllers"
+    controller_id = Column(String, primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class IngestCursor(Base):
+    """Último número de sequência gravado por controlador de porta (replay idempotente na reconexão)"""
+    __tablename__ = "ingest_cursors"
+    controller_id = Column(String, primary_key=True)
+    last_seq = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -0,0 +1,302 @@
+"""Ocupação em tempo real das áreas restritas: quem está dentro, quantos e por quanto tempo.
+
+O estado fica em memória e as leituras nunca tocam no banco. Os logs gravados por este worker em
+create_access_log são aplicados na hora (record); uma thread em segundo plano aplica os demais
+(outros workers, ingestão): cada shard tem uma marca d'água (último id aplicado) e, quando a versão
+'access_logs' do barramento muda, ela lê apenas os logs com id acima dela. Ids já aplicados por
+record acima da marca ficam em _ahead e são pulados quando o final do log chega neles.
+
+Entradas liberadas colocam o usuário na área e saídas liberadas o retiram, contando o tempo de
+permanência; negados não alteram a ocupação. A mesma thread grava o estado em
+OCCUPANCY_CHECKPOINT_PATH a cada OCCUPANCY_CHECKPOINT_EVERY eventos ou OCCUPANCY_CHECKPOINT_SECONDS,
+haja leitura ou não. Ao iniciar, ela recarrega o checkpoint e completa com o final do log sem
+segurar a subida da API; até terminar, as leituras respondem OccupancyNotReady. Exclusões de logs
+não desfazem eventos já aplicados.
+"""
+import os
+import json
+import time
+import datetime
+import threading
+from typing import Dict, Optional, Set
+from sqlalchemy import select, func
+from sqlalchemy.exc import SQLAlchemyError
+from . import models, cache_bus, sharding
+
+OCCUPANCY_CHECKPOINT_PATH = os.getenv('OCCUPANCY_CHECKPOINT_PATH', './occupancy_checkpoint.json')
+OCCUPANCY_CHECKPOINT_EVERY = int(os.getenv('OCCUPANCY_CHECKPOINT_EVERY', '1000'))
+OCCUPANCY_CHECKPOINT_SECONDS = float(os.getenv('OCCUPANCY_CHECKPOINT_SECONDS', '60'))
+# Intervalo com que a thread confere o barramento em busca de logs gravados fora deste worker
+OCCUPANCY_POLL_SECONDS = float(os.getenv('OCCUPANCY_POLL_SECONDS', '1'))
+# Logs lidos por consulta ao percorrer o final do log (ou o histórico, sem checkpoint)
+TAIL_CHUNK = 10000
+
+CHECKPOINT_FORMAT = 2
+
+
+class OccupancyNotReady(RuntimeError):
+    """Estado ainda sendo carregado (checkpoint + final do log) após a subida"""
+
+
+class AreaState:
+    """Ocupação de uma área: presentes (user_id -> entrada) e estatísticas das visitas concluídas"""
+
+    __slots__ = ('present', 'visits', 'dwell_total', 'dwell_max')
+
+    def __init__(self):
+        self.present: Dict[int, datetime.datetime] = {}
+        self.visits = 0
+        self.dwell_total = 0.0
+        self.dwell_max = 0.0
+
+    def stats(self, area_id: int) -> dict:
+        return {
+            "area_id": area_id,
+            "present_count": len(self.present),
+            "completed_visits": self.visits,
+            "avg_dwell_seconds": self.dwell_total / self.visits if self.visits else None,
+            "max_dwell_seconds": self.dwell_max if self.visits else None,
+        }
+
+    def dump(self) -> dict:
+        return {
+            "present": {str(user_id): entered.isoformat() for user_id, entered in self.present.items()},
+            "visits": self.visits,
+            "dwell_total": self.dwell_total,
+            "dwell_max": self.dwell_max,
+        }
+
+    @classmethod
+    def load(cls, data: dict):
+        state = cls()
+        state.present = {int(user_id): datetime.datetime.fromisoformat(entered) for user_id, entered in data["present"].items()}
+        state.visits = data["visits"]
+        state.dwell_total = data["dwell_total"]
+        state.dwell_max = data["dwell_max"]
+        return state
+
+
+class OccupancyTracker:
+    def __init__(self, checkpoint_path: Optional[str] = OCCUPANCY_CHECKPOINT_PATH):
+        self.checkpoint_path = checkpoint_path
+        self._areas: Dict[int, AreaState] = {}
+        self._total_present = 0
+        self._watermarks: Dict[int, int] = {}
+        # Ids acima da marca d'água já aplicados por record, por shard
+        self._ahead: Dict[int, Set[int]] = {}
+        self._versions = None
+        self._loaded = False
+        self._pending = 0
+        self._saved_at = time.monotonic()
+        # _lock protege o estado; _sync_lock garante um único leitor do final do log por vez
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- aplicação de eventos ----------------------------------------------
+
+    def _apply(self, user_id, area_id, access_type, status, access_time):
+        if user_id is None or area_id is None or status == 'denied':
+            return
+        state = self._areas.get(area_id)
+        if state is None:
+            state = self._areas[area_id] = AreaState()
+        if access_type == 'entry':
+            # Entrada repetida sem saída mantém o horário da primeira
+            if user_id not in state.present:
+                state.present[user_id] = access_time
+                self._total_present += 1
+        elif access_type == 'exit':
+            entered = state.present.pop(user_id, None)
+            if entered is not None:
+                self._total_present -= 1
+                dwell = max((access_time - entered).total_seconds(), 0.0)
+                state.visits += 1
+                state.dwell_total += dwell
+                state.dwell_max = max(state.dwell_max, dwell)
+
+    def _tail(self, shard, db):
+        """Aplica os logs do shard acima da marca d'água, em ordem de id e em lotes"""
+        log = models.AccessLog
+        after = self._watermarks.get(shard.number, 0)
+        while True:
+            rows = db.execute(
+                select(log.id, log.user_id, log.area_id, log.access_type, log.status, log.access_time)
+                .where(log.id > after).order_by(log.id).limit(TAIL_CHUNK)
+            ).all()
+            if not rows:
+                return
+            with self._lock:
+                ahead = self._ahead.get(shard.number, set())
+                for log_id, user_id, area_id, access_type, status, access_time in rows:
+                    if log_id in ahead:
+                        ahead.discard(log_id)
+                    else:
+                        self._apply(user_id, area_id, access_type, status, access_time)
+                        self._pending += 1
+                after = self._watermarks[shard.number] = rows[-1][0]
+                if ahead and min(ahead) <= after:
+                    # Logs excluídos antes de o final do log chegar neles
+                    self._ahead[shard.number] = {log_id for log_id in ahead if log_id > after}
+            if len(rows) < TAIL_CHUNK:
+                return
+
+    def record(self, log):
+        """Aplica um log recém-gravado por este worker, sem esperar a thread passar por ele"""
+        number = sharding.shard_for_log(log.id).number
+        with self._lock:
+            if log.id <= self._watermarks.get(number, 0):
+                return
+            ahead = self._ahead.setdefault(number, set())
+            if log.id in ahead:
+                return
+            ahead.add(log.id)
+            self._apply(log.user_id, log.area_id, log.access_type, log.status, log.access_time)
+            self._pending += 1
+
+    def sync(self):
+        """Traz o estado até o último log gravado; sem escrita nova desde a última chamada, não consulta o banco"""
+        # Versão lida antes do tail: um log gravado durante a leitura dispara outra rodada depois
+        versions = cache_bus.bus.versions(('access_logs',))
+        if self._loaded and versions == self._versions:
+            return
+        with self._sync_lock:
+            if not self._loaded:
+                self._load_checkpoint()
+                self._loaded = True
+            elif versions == self._versions:
+                return
+            sharding.each(self._tail)
+            self._versions = versions
+
+    # --- thread em segundo plano ----------------------------------------------
+
+    def start(self):
+        """Inicia a thread que carrega o estado, acompanha o log e grava o checkpoint (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='occupancy-tracker', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Para a thread e grava o checkpoint final"""
+        thread = self._thread
+        self._stopping.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+        if self._ready.is_set():
+            self.save()
+
+    def wake(self):
+        """Antecipa a próxima rodada da thread (ex.: após uma escrita em lote)"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+                self._ready.set()
+                if self._pending and (self._pending >= OCCUPANCY_CHECKPOINT_EVERY
+                                      or time.monotonic() - self._saved_at >= OCCUPANCY_CHECKPOINT_SECONDS):
+                    self.save()
+            except (SQLAlchemyError, OSError):
+                # Banco ou disco indisponível: tenta de novo na próxima rodada
+                pass
+            self._wake.wait(OCCUPANCY_POLL_SECONDS)
+            self._wake.clear()
+
+    # --- checkpoint ----------------------------------------------------------
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("format") != CHECKPOINT_FORMAT:
+                return
+            watermarks = {int(number): last_id for number, last_id in data["watermarks"].items()}
+            ahead = {int(number): set(ids) for number, ids in data["ahead"].items()}
+            areas = {int(area_id): AreaState.load(state) for area_id, state in data["areas"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            # Checkpoint ilegível: o estado é reconstruído a partir do histórico
+            return
+        # Marca d'água acima do maior id do shard indica banco recriado: o checkpoint não vale mais
+        last_ids = sharding.each(lambda shard, db: db.execute(select(func.max(models.AccessLog.id))).scalar() or 0)
+        if any(watermarks.get(number, 0) > last_id for number, last_id in enumerate(last_ids)):
+            return
+        with self._lock:
+            self._watermarks = watermarks
+            self._ahead = ahead
+            self._areas = areas
+            self._total_present = sum(len(state.present) for state in areas.values())
+
+    def save(self):
+        """Grava estado e marcas d'água de forma atômica (arquivo temporário + rename)"""
+        with self._lock:
+            data = {
+                "format": CHECKPOINT_FORMAT,
+                "watermarks": {str(number): last_id for number, last_id in self._watermarks.items()},
+                "ahead": {str(number): sorted(ids) for number, ids in self._ahead.items() if ids},
+                "areas": {str(area_id): state.dump() for area_id, state in self._areas.items()},
+            }
+            self._pending = 0
+            self._saved_at = time.monotonic()
+        if not self.checkpoint_path:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        tmp = f'{self.checkpoint_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def reset(self):
+        """Descarta estado e checkpoint (banco de logs recriado)"""
+        with self._sync_lock, self._lock:
+            self._areas = {}
+            self._total_present = 0
+            self._watermarks = {}
+            self._ahead = {}
+            self._versions = None
+            self._loaded = False
+            self._pending = 0
+            self._ready.clear()
+            if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+
+    # --- leituras ------------------------------------------------------------
+
+    def _check_ready(self):
+        if not self._ready.is_set():
+            # Fora da API (scripts) ninguém iniciou a thread: a primeira leitura inicia
+            self.start()
+            raise OccupancyNotReady('Occupancy state is still loading')
+
+    def area(self, area_id: int) -> dict:
+        """Presentes (por ordem de entrada) e estatísticas de permanência da área"""
+        self._check_ready()
+        with self._lock:
+            state = self._areas.get(area_id) or AreaState()
+            result = state.stats(area_id)
+            present = list(state.present.items())
+        present.sort(key=lambda item: item[1])
+        result["occupants"] = [{"user_id": user_id, "entered_at": entered} for user_id, entered in present]
+        return result
+
+    def summary(self) -> dict:
+        """Contagem de presentes e estatísticas de todas as áreas com algum evento"""
+        self._check_ready()
+        with self._lock:
+            return {
+                "total_present": self._total_present,
+                "areas": [state.stats(area_id) for area_id, state in sorted(self._areas.items())],
+            }
+
+
+tracker = OccupancyTracker()
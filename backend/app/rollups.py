@@ -0,0 +1,40 @@
+"""Backfill dos agregados de acesso (access_log_rollups) em bancos que já tinham logs.
+
+Até o backfill, o heatmap desses bancos lê os logs brutos (source 'raw' ou 'mixed'):
+
+    python -m app.rollups           # recalcula os bancos (principal e shards) ainda sem backfill
+    python -m app.rollups --force   # recalcula todos
+"""
+import sys
+import time
+import argparse
+from . import analytics, crud, database, sharding
+
+
+def backfill(force: bool = False):
+    database.upgrade_database()
+    for shard in sharding.shards():
+        db = shard.SessionLocal()
+        try:
+            label = shard.site or 'banco principal'
+            if analytics.rollups_available(db) and not force:
+                print(f'{label}: agregados já completos')
+                continue
+            started = time.perf_counter()
+            crud.rebuild_access_rollups(db)
+            analytics.pack_rollup_vectors(shard, db)
+            print(f'{label}: agregados recalculados em {time.perf_counter() - started:.1f}s')
+        finally:
+            db.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill dos agregados de acesso a partir de access_logs')
+    parser.add_argument('--force', action='store_true', help='recalcula mesmo onde o backfill já foi feito')
+    args = parser.parse_args(argv)
+    return backfill(args.force)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
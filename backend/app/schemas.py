@@ -1,7 +1,19 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, validator
 from typing import Optional, List
 import datetime
 
+USER_ROLES = ['employee', 'manager', 'security_admin']
+
+def validate_user_role(v):
+    if v not in USER_ROLES:
+        raise ValueError(f'Papel deve ser um dos: {", ".join(USER_ROLES)}')
+    return v
+
+def validate_not_null(v):
+    if v is None:
+        raise ValueError('Campo não pode ser nulo')
+    return v
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
@@ -9,6 +21,10 @@ class UserCreate(BaseModel):
     full_name: Optional[str]
     role: Optional[str] = "employee"
 
+    @validator('role')
+    def role_must_be_valid(cls, v):
+        return validate_user_role(v)
+
 class UserOut(BaseModel):
     id: int
     username: str
@@ -17,11 +33,42 @@ class UserOut(BaseModel):
     role: str
     is_active: bool
     created_at: datetime.datetime
+    version: int
     class Config:
         from_attributes = True
 
+class UserPatch(BaseModel):
+    """Atualização parcial de usuário: só os campos enviados são gravados"""
+    username: Optional[str] = None
+    email: Optional[EmailStr] = None
+    password: Optional[str] = None
+    full_name: Optional[str] = None
+    role: Optional[str] = None
+    is_active: Optional[bool] = None
+
+    # null explícito só é aceito em full_name; nos demais campos a coluna é obrigatória
+    @validator('username', 'email', 'is_active')
+    def must_not_be_null(cls, v):
+        return validate_not_null(v)
+
+    @validator('username')
+    def username_must_not_be_empty(cls, v):
+        if not v.strip():
+            raise ValueError('O nome de usuário não pode estar vazio')
+        return v.strip()
+
+    @validator('password')
+    def password_must_not_be_empty(cls, v):
+        if not v:
+            raise ValueError('A senha não pode estar vazia')
+        return v
+
+    @validator('role')
+    def role_must_be_valid(cls, v):
+        return validate_user_role(v)
+
 class UserWithAreas(UserOut):
-    accessible_areas: List['RestrictedAreaOut'] = []
+    accessible_areas: List['RestrictedAreaSummary'] = []
 
 class Token(BaseModel):
     access_token: str
@@ -36,6 +83,22 @@ from pydantic import BaseModel, EmailStr, validator
 from typing import Optional, List
 import datetime
 
+def validate_resource_name(v):
+    if not v or not v.strip():
+        raise ValueError('O nome do recurso não pode estar vazio')
+    return v.strip()
+
+def validate_resource_type(v):
+    valid_types = ['equipment', 'vehicle', 'security_device', 'other']
+    if v not in valid_types:
+        raise ValueError(f'Tipo deve ser um dos: {", ".join(valid_types)}')
+    return v
+
+def validate_resource_status(v):
+    if v not in ['available', 'in_use', 'maintenance', 'out_of_service']:
+        raise ValueError('Status inválido')
+    return v
+
 class ResourceCreate(BaseModel):
     name: str
     type: str
@@ -45,27 +108,41 @@ class ResourceCreate(BaseModel):
 
     @validator('name')
     def name_must_not_be_empty(cls, v):
-        if not v or not v.strip():
-            raise ValueError('O nome do recurso não pode estar vazio')
-        return v.strip()
+        return validate_resource_name(v)
 
     @validator('type')
     def type_must_be_valid(cls, v):
-        valid_types = ['equipment', 'vehicle', 'security_device', 'other']
-        if v not in valid_types:
-            raise ValueError(f'Tipo deve ser um dos: {", ".join(valid_types)}')
-        return v
+        return validate_resource_type(v)
 
     @validator('status')
     def status_must_be_valid(cls, v):
-        if v not in ['available', 'in_use', 'maintenance', 'out_of_service']:
-            raise ValueError('Status inválido')
-        return v
+        return validate_resource_status(v)
+
+class ResourcePatch(BaseModel):
+    """Atualização parcial: só os campos enviados são gravados"""
+    name: Optional[str] = None
+    type: Optional[str] = None
+    details: Optional[str] = None
+    status: Optional[str] = None
+    location: Optional[str] = None
+
+    @validator('name')
+    def name_must_not_be_empty(cls, v):
+        return validate_resource_name(v)
+
+    @validator('type')
+    def type_must_be_valid(cls, v):
+        return validate_resource_type(v)
+
+    @validator('status')
+    def status_must_be_valid(cls, v):
+        return validate_resource_status(v)
 
 class ResourceOut(ResourceCreate):
     id: int
     created_at: datetime.datetime
     updated_at: datetime.datetime
+    version: int
     
     class Config:
         from_attributes = True
@@ -76,23 +153,72 @@ class RestrictedAreaCreate(BaseModel):
     security_level: Optional[str] = "medium"
     location: Optional[str] = None
 
-class RestrictedAreaOut(RestrictedAreaCreate):
+class RestrictedAreaSummary(RestrictedAreaCreate):
+    """Área embutida em outras respostas (logs, usuário atual), sem membros"""
     id: int
-    authorized_users: List[UserOut] = []
     class Config:
         from_attributes = True
 
+class RestrictedAreaOut(RestrictedAreaSummary):
+    member_count: int = 0
+
+class RestrictedAreaWithMembers(RestrictedAreaOut):
+    """Listagem com include_members=true: embute todos os usuários autorizados"""
+    authorized_users: List[UserOut] = []
+
+class AreaMembers(BaseModel):
+    total: int
+    items: List[UserOut]
+
+class AreaOccupant(BaseModel):
+    user_id: int
+    entered_at: datetime.datetime
+
+class OccupancyStats(BaseModel):
+    area_id: int
+    present_count: int
+    completed_visits: int
+    avg_dwell_seconds: Optional[float] = None
+    max_dwell_seconds: Optional[float] = None
+
+class AreaOccupancy(OccupancyStats):
+    occupants: List[AreaOccupant]
+
+class OccupancySummary(BaseModel):
+    total_present: int
+    areas: List[OccupancyStats]
+
 class AccessLogCreate(BaseModel):
     user_id: int
     area_id: int
     access_type: Optional[str] = "entry"
     status: Optional[str] = "granted"
 
+class IngestControllerCreate(BaseModel):
+    controller_id: str
+    owner_id: int
+
+    @validator('controller_id')
+    def controller_id_must_not_be_empty(cls, v):
+        if not v.strip():
+            raise ValueError('O id do controlador não pode estar vazio')
+        return v.strip()
+
+class IngestControllerOut(IngestControllerCreate):
+    created_at: datetime.datetime
+    class Config:
+        from_attributes = True
+
+class AccessLogEvent(AccessLogCreate):
+    """Evento enviado por um controlador pelo canal de ingestão, com número de sequência"""
+    seq: int
+    access_time: Optional[datetime.datetime] = None
+
 class AccessLogOut(AccessLogCreate):
     id: int
     access_time: datetime.datetime
     user: Optional[UserOut] = None
-    area: Optional[RestrictedAreaOut] = None
+    area: Optional[RestrictedAreaSummary] = None
     class Config:
         from_attributes = True
 
@@ -105,6 +231,62 @@ class DashboardStats(BaseModel):
     resources_by_type: dict
     access_by_hour: dict
 
+class DenialRate(BaseModel):
+    user_id: Optional[int] = None
+    area_id: Optional[int] = None
+    total: int
+    denied: int
+    denial_rate: float
+
+class AccessBurst(BaseModel):
+    area_id: int
+    bucket_start: datetime.datetime
+    events: int
+    denied: int
+    baseline_mean: float
+    z_score: float
+
+class AnomalousAccess(BaseModel):
+    log_id: int
+    user_id: int
+    area_id: int
+    access_time: datetime.datetime
+    kind: Optional[str] = None
+
+class AnomalyReport(BaseModel):
+    window_start: datetime.datetime
+    window_end: datetime.datetime
+    total_events: int
+    denied_events: int
+    denial_rates_by_user: List[DenialRate]
+    denial_rates_by_area: List[DenialRate]
+    bursts: List[AccessBurst]
+    after_hours_critical_total: int
+    after_hours_critical: List[AnomalousAccess]
+    impossible_sequences_total: int
+    impossible_sequences: List[AnomalousAccess]
+
+class AccessHeatmap(BaseModel):
+    bucket: str
+    start: datetime.datetime
+    end: datetime.datetime
+    source: str
+    area_ids: List[int]
+    area_names: List[str]
+    buckets: List[datetime.datetime]
+    granted: List[List[int]]
+    denied: List[List[int]]
+
+class BulkRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class BulkImportReport(BaseModel):
+    total: int
+    inserted: int
+    failed: int
+    errors: List[BulkRowError]
+
 class AreaAccessRequest(BaseModel):
     user_id: int
     area_id: int
@@ -0,0 +1,204 @@
+"""Particionamento opcional de access_logs (e agregados) em um arquivo SQLite por site.
+
+Com ACCESS_LOG_SHARDS="Edifício A=./shards/edificio_a.db;Edifício B=./shards/edificio_b.db",
+os logs de áreas cujo `location` começa pelo site (texto antes da primeira vírgula) são gravados
+no arquivo do site, cada um com seu próprio lock de escrita; as demais áreas continuam no banco
+principal (shard 0). Sem a variável há um único shard e nada muda.
+
+Os ids continuam únicos: o AUTOINCREMENT do shard k começa em k << SHARD_ID_BITS, então o id
+indica o shard. A numeração segue a ordem da configuração — sites novos vão sempre no fim.
+Leituras consultam os shards em paralelo e juntam o resultado por access_time.
+"""
+import os
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import Session, sessionmaker
+from . import models, schemas, cache_bus, columnar
+from .database import Base, SessionLocal, ReadSessionLocal, MARK_ROLLUPS_IF_EMPTY, MARK_ROLLUP_VECTORS_IF_EMPTY, engine as main_engine
+
+ACCESS_LOG_SHARDS = os.getenv('ACCESS_LOG_SHARDS', '')
+SHARD_ID_BITS = 40
+# Mapa área -> shard, recalculado quando áreas mudam (ou a cada TTL)
+SHARD_MAP_TTL = 300
+
+SHARD_TABLES = [models.AccessLog.__table__, models.AccessLogRollup.__table__, models.AccessLogRollupState.__table__,
+                models.AccessLogRollupVector.__table__, models.IngestCursor.__table__]
+
+
+class Shard:
+    def __init__(self, number: int, site, engine, session_factory, read_session_factory):
+        self.number = number
+        self.site = site
+        self.engine = engine
+        self.SessionLocal = session_factory
+        self.ReadSessionLocal = read_session_factory
+
+
+def site_of(location) -> str:
+    return (location or '').split(',')[0].strip().casefold()
+
+
+def _configure(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _prepare(shard: Shard):
+    """Cria as tabelas de logs no arquivo do shard e posiciona o AUTOINCREMENT na faixa dele"""
+    Base.metadata.create_all(bind=shard.engine, tables=SHARD_TABLES)
+    with shard.engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'access_logs', :base "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'access_logs')"
+        ), {"base": shard.number << SHARD_ID_BITS})
+        conn.execute(MARK_ROLLUPS_IF_EMPTY)
+        conn.execute(MARK_ROLLUP_VECTORS_IF_EMPTY)
+    # Sem isso o store colunar do shard veria (id - 0) logs pendentes e tentaria selar a cada escrita
+    columnar.register_shard(shard.engine, shard.number << SHARD_ID_BITS)
+
+
+_shards = None
+_shards_lock = threading.Lock()
+
+
+def shards():
+    """Shard 0 (banco principal) seguido dos shards configurados, criados no primeiro uso"""
+    global _shards
+    if _shards is None:
+        with _shards_lock:
+            if _shards is None:
+                result = [Shard(0, None, main_engine, SessionLocal, ReadSessionLocal)]
+                entries = [entry.split('=', 1) for entry in ACCESS_LOG_SHARDS.split(';') if entry.strip()]
+                for number, (site, path) in enumerate(entries, start=1):
+                    path = path.strip()
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+                    event.listen(engine, "connect", _configure)
+                    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                    shard = Shard(number, site_of(site), engine, factory, factory)
+                    _prepare(shard)
+                    result.append(shard)
+                _shards = result
+    return _shards
+
+
+def enabled() -> bool:
+    return len(shards()) > 1
+
+
+def recreate():
+    """Recria as tabelas de logs dos shards (banco principal recriado por recreate_database)"""
+    for shard in shards()[1:]:
+        Base.metadata.drop_all(bind=shard.engine, tables=SHARD_TABLES)
+        _prepare(shard)
+
+
+# --- roteamento ------------------------------------------------------------
+
+_area_map = cache_bus.VersionedCache(('restricted_areas',), SHARD_MAP_TTL, max_entries=1)
+
+
+def _compute_area_map():
+    by_site = {shard.site: shard.number for shard in shards()[1:]}
+    db = SessionLocal()
+    try:
+        areas = db.execute(select(models.RestrictedArea.id, models.RestrictedArea.location)).all()
+    finally:
+        db.close()
+    return {area_id: by_site.get(site_of(location), 0) for area_id, location in areas}
+
+
+def shard_for_area(area_id: int) -> Shard:
+    if not enabled():
+        return shards()[0]
+    return shards()[_area_map.get_or_compute('areas', _compute_area_map).get(area_id, 0)]
+
+
+def shard_for_log(log_id: int) -> Shard:
+    number = log_id >> SHARD_ID_BITS
+    return shards()[number] if number < len(shards()) else shards()[0]
+
+
+@contextmanager
+def session(db: Session, shard: Shard, write: bool = True):
+    """Sessão do shard; no shard 0 reaproveita a sessão `db` do request"""
+    if shard.number == 0 and db is not None:
+        yield db
+        return
+    shard_db = (shard.SessionLocal if write else shard.ReadSessionLocal)()
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+# --- scatter-gather --------------------------------------------------------
+
+_executor = None
+
+
+def each(fn, db: Session = None, write: bool = False):
+    """Executa fn(shard, sessão) em cada shard, em paralelo, e retorna os resultados na ordem dos shards"""
+    global _executor
+
+    def run(shard):
+        with session(db, shard, write) as shard_db:
+            return fn(shard, shard_db)
+
+    if not enabled():
+        return [run(shards()[0])]
+    if _executor is None:
+        with _shards_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=len(shards()) * 2, thread_name_prefix='shard')
+    # O shard 0 usa a sessão do request, que não pode ir para outra thread
+    futures = [_executor.submit(run, shard) for shard in shards()[1:]]
+    return [run(shards()[0])] + [future.result() for future in futures]
+
+
+def scatter(fn, db: Session = None, write: bool = False):
+    """Como each, para funções que só precisam da sessão: fn(sessão)"""
+    return each(lambda shard, shard_db: fn(shard_db), db, write)
+
+
+def recent_logs(db: Session, query, skip: int = 0, limit: int = 100):
+    """Página de logs do mais recente para o mais antigo em todos os shards.
+
+    query(sessão, skip, limit) devolve logs ordenados por access_time desc; cada shard contribui
+    com até skip + limit linhas e o heapq.merge intercala as listas já ordenadas.
+    """
+    if not enabled():
+        return query(db, skip, limit)
+    results = scatter(lambda shard_db: query(shard_db, 0, skip + limit), db)
+    merged = heapq.merge(*results, key=lambda log: (log.access_time, log.id), reverse=True)
+    return list(itertools.islice(merged, skip, skip + limit))
+
+
+def logs_out(db: Session, logs):
+    """AccessLogOut com usuário e área carregados do banco principal em duas consultas.
+
+    Logs de outros shards não alcançam as tabelas users/restricted_areas pelos relacionamentos.
+    """
+    user_ids = {log.user_id for log in logs if log.user_id is not None}
+    area_ids = {log.area_id for log in logs if log.area_id is not None}
+    users = {user.id: user for user in db.query(models.User).filter(models.User.id.in_(user_ids))} if user_ids else {}
+    areas = {area.id: area for area in db.query(models.RestrictedArea).filter(models.RestrictedArea.id.in_(area_ids))} if area_ids else {}
+    return [
+        schemas.AccessLogOut(
+            id=log.id,
+            user_id=log.user_id,
+            area_id=log.area_id,
+            access_type=log.access_type,
+            status=log.status,
+            access_time=log.access_time,
+            user=users.get(log.user_id) and schemas.UserOut.model_validate(users[log.user_id]),
+            area=areas.get(log.area_id) and schemas.RestrictedAreaSummary.model_validate(areas[log.area_id]),
+        )
+        for log in logs
+    ]
@@ -0,0 +1,131 @@
+import os
+import asyncio
+import threading
+from collections import defaultdict
+from starlette.concurrency import run_in_threadpool
+
+# Tempo máximo que uma requisição espera pelo cálculo em andamento antes de calcular por conta própria
+SINGLEFLIGHT_TIMEOUT_SECONDS = float(os.getenv('SINGLEFLIGHT_TIMEOUT_SECONDS', '10'))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = []  # (loop, future) dos seguidores async
+
+    def finish(self):
+        """Chamado com o lock do grupo: acorda os seguidores síncronos e os async"""
+        self.done.set()
+        for loop, future in self.waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Group:
+    """Requisições concorrentes com a mesma chave compartilham uma única execução (single-flight).
+
+    O resultado precisa ser independente da sessão do líder (schemas/dicts, não objetos ORM),
+    pois é entregue a requisições que já fecharam ou nunca usaram a própria sessão.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {"requests": 0, "executions": 0, "shared": 0, "timeouts": 0, "errors": 0})
+
+    def do(self, key, fn, timeout: float = SINGLEFLIGHT_TIMEOUT_SECONDS):
+        """key é uma tupla (rota, *parâmetros normalizados, papel); key[0] agrupa as métricas"""
+        route = key[0]
+        with self._lock:
+            metrics = self._metrics[route]
+            metrics["requests"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                metrics["executions"] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as exc:
+                call.error = exc
+                with self._lock:
+                    metrics["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    call.finish()
+            return call.result
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                metrics["timeouts"] += 1
+                metrics["executions"] += 1
+            return fn()
+        return self._shared(call, metrics)
+
+    async def do_async(self, key, fn, timeout: float = SINGLEFLIGHT_TIMEOUT_SECONDS):
+        """Como do(), para endpoints async: o líder roda fn no threadpool e os seguidores esperam
+        no loop de eventos, sem ocupar thread nem conexão do banco"""
+        route = key[0]
+        with self._lock:
+            metrics = self._metrics[route]
+            metrics["requests"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                metrics["executions"] += 1
+            else:
+                waiter = asyncio.get_running_loop().create_future()
+                call.waiters.append((asyncio.get_running_loop(), waiter))
+
+        if leader:
+            try:
+                call.result = await run_in_threadpool(fn)
+            except BaseException as exc:
+                # Inclui o cancelamento do líder: os seguidores recebem o erro, não um resultado vazio
+                call.error = exc
+                with self._lock:
+                    metrics["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    call.finish()
+            return call.result
+
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                metrics["timeouts"] += 1
+                metrics["executions"] += 1
+            return await run_in_threadpool(fn)
+        return self._shared(call, metrics)
+
+    def _shared(self, call, metrics):
+        with self._lock:
+            metrics["shared"] += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def metrics(self):
+        with self._lock:
+            return {
+                route: dict(values, in_flight=sum(1 for key in self._calls if key[0] == route))
+                for route, values in self._metrics.items()
+            }
+
+
+group = Group()
+
@@ -8,6 +8,7 @@ import {
   deleteRestrictedArea,
   grantAreaAccess,
   revokeAreaAccess,
+  listAreaMembers,
   listUsers
 } from '../services/api'
 
@@ -19,6 +20,8 @@ export default function RestrictedAreas() {
   const [showForm, setShowForm] = useState(false)
   const [editingArea, setEditingArea] = useState(null)
   const [accessManagement, setAccessManagement] = useState(null)
+  const [members, setMembers] = useState({ total: 0, items: [] })
+  const [memberSearch, setMemberSearch] = useState('')
   
   const [form, setForm] = useState({
     name: '',
@@ -57,6 +60,27 @@ export default function RestrictedAreas() {
     }
   }
 
+  const loadMembers = async (areaId, q = '') => {
+    try {
+      const data = await listAreaMembers(areaId, { q })
+      setMembers(data)
+    } catch (error) {
+      console.error('Erro ao carregar usuários da área:', error)
+    }
+  }
+
+  const openAccessManagement = (area) => {
+    setAccessManagement(area)
+    setMembers({ total: 0, items: [] })
+    setMemberSearch('')
+    loadMembers(area.id)
+  }
+
+  const handleMemberSearch = (value) => {
+    setMemberSearch(value)
+    loadMembers(accessManagement.id, value)
+  }
+
   const resetForm = () => {
     setForm({
       name: '',
@@ -132,7 +156,7 @@ export default function RestrictedAreas() {
       await grantAreaAccess(areaId, userId)
       alert('Acesso concedido com sucesso!')
       setAccessManagement(null)
-      loadAreas() // Recarregar para atualizar a lista de usuários autorizados
+      loadAreas() // Recarregar para atualizar a contagem de usuários autorizados
     } catch (error) {
       console.error('Erro ao conceder acesso:', error)
       alert('Erro ao conceder acesso: ' + error.message)
@@ -147,7 +171,8 @@ export default function RestrictedAreas() {
     try {
       await revokeAreaAccess(areaId, userId)
       alert('Acesso revogado com sucesso!')
-      loadAreas() // Recarregar para atualizar a lista de usuários autorizados
+      loadMembers(areaId, memberSearch)
+      loadAreas() // Recarregar para atualizar a contagem de usuários autorizados
     } catch (error) {
       console.error('Erro ao revogar acesso:', error)
       alert('Erro ao revogar acesso: ' + error.message)
@@ -338,7 +363,7 @@ export default function RestrictedAreas() {
                   >
                     <option value="">Selecione um usuário</option>
                     {users.filter(user => 
-                      !accessManagement.authorized_users?.some(authorized => authorized.id === user.id)
+                      !members.items.some(member => member.id === user.id)
                     ).map(user => (
                       <option key={user.id} value={user.id}>
                         {user.full_name || user.username} ({user.role})
@@ -357,11 +382,18 @@ export default function RestrictedAreas() {
               {/* Lista de usuários com acesso */}
               <div>
                 <h3 className="text-sm font-medium text-slate-300 mb-2">
-                  Usuários com Acesso ({accessManagement.authorized_users?.length || 0})
+                  Usuários com Acesso ({members.total})
                 </h3>
+                <input
+                  type="text"
+                  value={memberSearch}
+                  onChange={(e) => handleMemberSearch(e.target.value)}
+                  placeholder="Buscar por nome, usuário ou e-mail"
+                  className="w-full mb-2 px-3 py-2 bg-slate-700/50 border border-slate-600 rounded-md text-white placeholder-slate-400 focus:outline-none focus:ring-2 focus:ring-emerald-500 focus:border-transparent"
+                />
                 <div className="space-y-2 max-h-60 overflow-y-auto">
-                  {accessManagement.authorized_users?.length > 0 ? (
-                    accessManagement.authorized_users.map(user => (
+                  {members.items.length > 0 ? (
+                    members.items.map(user => (
                       <div key={user.id} className="flex items-center justify-between bg-slate-700/30 rounded-lg p-3">
                         <div>
                           <div className="text-white font-medium">
@@ -418,7 +450,7 @@ export default function RestrictedAreas() {
                       </div>
                       <div className="flex gap-2">
                         <button
-                          onClick={() => setAccessManagement(area)}
+                          onClick={() => openAccessManagement(area)}
                           className="p-2 text-slate-400 hover:text-blue-400 transition duration-200"
                           title="Gerenciar acesso"
                         >
@@ -448,7 +480,7 @@ export default function RestrictedAreas() {
                       </span>
                       <span className="inline-flex items-center gap-1 px-3 py-1 rounded-full text-sm font-medium bg-blue-500/20 text-blue-400 border border-blue-500/30">
                         <Users className="h-3 w-3" />
-                        {area.authorized_users?.length || 0} usuários
+                        {area.member_count || 0} usuários
                       </span>
                     </div>
                     
@@ -13,6 +13,8 @@ async function apiRequest(endpoint, options = {}) {
       'Content-Type': 'application/json',
       ...options.headers,
     },
+    // Envia o cookie de read-your-writes: após uma escrita, as leituras seguintes a enxergam em qualquer worker
+    credentials: 'include',
     ...options,
   }
 
@@ -168,8 +170,13 @@ export async function deleteUser(userId) {
 // FUNÇÕES DE RECURSOS
 // ==============================================================================
 
-export async function listResources() {
-  return apiRequest('/resources/')
+// filters: { type, status, location, q, skip, limit } — filtragem e busca feitas no servidor
+export async function listResources(filters = {}) {
+  const params = new URLSearchParams(
+    Object.entries(filters).filter(([, value]) => value !== undefined && value !== null && value !== '')
+  )
+  const query = params.toString()
+  return apiRequest(`/resources/${query ? `?${query}` : ''}`)
 }
 
 export async function createResource(resource) {
@@ -387,6 +394,20 @@ export async function deleteRestrictedArea(areaId) {
   }
 }
 
+export async function listAreaMembers(areaId, { skip = 0, limit = 100, q = '' } = {}) {
+  const params = new URLSearchParams({ skip, limit })
+  if (q) params.set('q', q)
+  return apiRequest(`/restricted-areas/${areaId}/members?${params.toString()}`)
+}
+
+export async function getAreaOccupancy(areaId) {
+  return apiRequest(`/restricted-areas/${areaId}/occupancy`)
+}
+
+export async function getOccupancySummary() {
+  return apiRequest('/restricted-areas/occupancy')
+}
+
 export async function grantAreaAccess(areaId, userId) {
   return apiRequest(`/restricted-areas/${areaId}/grant-access/${userId}`, {
     method: 'POST',